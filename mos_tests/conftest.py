@@ -16,39 +16,61 @@ from collections import namedtuple
 from distutils.spawn import find_executable
 import logging
 import os
+import sys
+import threading
 import uuid
 
 import pytest
+import six
 from six.moves import configparser
 
 from mos_tests.environment.devops_client import DevopsClient
 from mos_tests.environment.fuel_client import FuelClient
+from mos_tests.environment.ssh import connection_pool
 from mos_tests.functions.common import gen_temp_file
 from mos_tests.functions.common import get_os_conn
-from mos_tests.functions.common import wait
+from mos_tests.functions.common import wait_timings
 from mos_tests.functions import os_cli
 from mos_tests.settings import KEYSTONE_PASS
 from mos_tests.settings import KEYSTONE_USER
 from mos_tests.settings import SERVER_ADDRESS
 from mos_tests.settings import SSH_CREDENTIALS
+from plugins.revert_scheduler import get_dirties_scope
 
 logger = logging.getLogger(__name__)
 
 
 # Define pytest plugins to use
-pytest_plugins = ("plugins.incremental",
+pytest_plugins = ("plugins.duration_order",
+                  "plugins.incremental",
+                  "plugins.revert_scheduler",
                   "plugins.testrail_id")
 
 
 def pytest_addoption(parser):
     parser.addoption("--fuel-ip", '-I', action="store",
-                     help="Fuel master server ip address")
+                     help="Fuel master server ip address. Comma separated "
+                          "list to bind each xdist worker to own server")
     parser.addoption("--env", '-E', action="store",
-                     help="Fuel devops env name")
+                     help="Fuel devops env name. Comma separated list to "
+                          "bind each xdist worker to own env")
     parser.addoption("--snapshot", '-S', action="store",
-                     help="Fuel devops snapshot name")
+                     help="Fuel devops snapshot name. Comma separated list "
+                          "to use different snapshots for xdist workers")
+    parser.addoption("--share-env", action="store_true",
+                     help="Allow all xdist workers to use single devops env "
+                          "(tests of workers will interfere)")
     parser.addoption("--cluster", '-C', action="append",
                      help="Fuel cluster name to test on it")
+    parser.addoption("--ostf-check", action="store_true",
+                     help="Wait for OSTF HA tests pass after revert in "
+                          "addition to services readiness checks")
+    parser.addoption("--slowest-waits", action="store", type=int,
+                     default=0, metavar="N",
+                     help="Show N slowest waits (0 for disabled)")
+    parser.addoption("--check-dirty-state", action="store_true",
+                     help="Revert snapshot after destructive test only if "
+                          "environment state fingerprint is changed")
 
 
 def pytest_configure(config):
@@ -66,6 +88,7 @@ def pytest_configure(config):
         "testrail_id(id, params={'name': value,...}): add suffix to "
         "test name. If defined, `params` apply case_id only if it "
         "matches test params.")
+    check_workers_envs(config)
 
 
 @pytest.hookimpl(tryfirst=True, hookwrapper=True)
@@ -83,6 +106,65 @@ def pytest_runtest_teardown(item, nextitem):
     setattr(item.session, "nextitem", nextitem)
 
 
+def get_worker_index(config):
+    """Return pytest-xdist worker number (0 without xdist)"""
+    workerinput = getattr(config, 'workerinput', None)
+    if workerinput is None:
+        workerinput = getattr(config, 'slaveinput', None)
+    if workerinput is None:
+        return 0
+    worker_id = workerinput.get('workerid') or workerinput['slaveid']
+    return int(worker_id.lstrip('gw'))
+
+
+def check_workers_envs(config):
+    """Forbid to run several xdist workers on single devops env
+
+    Each worker reverts and changes its env, so workers need own envs,
+    unless `--share-env` is passed.
+    """
+    is_worker = any(hasattr(config, x)
+                    for x in ('workerinput', 'slaveinput'))
+    if is_worker or config.getoption('--share-env'):
+        return
+    workers = config.getoption('numprocesses', None)
+    if not workers:
+        return
+    try:
+        if int(workers) < 2:
+            return
+    except ValueError:
+        # 'auto' workers count
+        pass
+    env_names = config.getoption('--env')
+    if env_names and len(env_names.split(',')) == 1:
+        raise pytest.UsageError(
+            'Single devops env {} for {} xdist workers, pass comma '
+            'separated list of envs (one per worker) or --share-env'.format(
+                env_names, workers))
+
+
+def get_worker_option(config, name):
+    """Return option value for current xdist worker
+
+    Option may contain comma separated list of values - one per worker.
+    Single value is shared between all workers (for --env it is allowed
+    only with --share-env, see `check_workers_envs`).
+    """
+    value = config.getoption(name)
+    if not value:
+        return value
+    values = value.split(',')
+    if len(values) == 1:
+        return values[0]
+    index = get_worker_index(config)
+    if index >= len(values):
+        raise pytest.UsageError(
+            'Not enough {} values ({}) for worker gw{}, reduce workers '
+            'count'.format(name, value, index))
+    return values[index]
+
+
 @pytest.fixture
 def suffix():
     return str(uuid.uuid4())
@@ -90,7 +172,7 @@ def suffix():
 
 @pytest.fixture(scope="session")
 def env_name(request):
-    return request.config.getoption("--env")
+    return get_worker_option(request.config, "--env")
 
 
 @pytest.fixture(scope='session')
@@ -100,13 +182,13 @@ def devops_env(env_name):
 
 @pytest.fixture(scope="session")
 def snapshot_name(request):
-    return request.config.getoption("--snapshot")
+    return get_worker_option(request.config, "--snapshot")
 
 
 @pytest.fixture(scope="session")
 def fuel_master_ip(request, env_name, snapshot_name):
     """Get fuel master ip"""
-    fuel_ip = request.config.getoption("--fuel-ip")
+    fuel_ip = get_worker_option(request.config, "--fuel-ip")
     if not fuel_ip:
         fuel_ip = DevopsClient.get_admin_node_ip(env_name=env_name)
     if not fuel_ip:
@@ -117,6 +199,117 @@ def fuel_master_ip(request, env_name, snapshot_name):
 def revert_snapshot(env_name, snapshot_name):
     DevopsClient.revert_snapshot(env_name=env_name,
                                  snapshot_name=snapshot_name)
+    # Connections established before revert are dead now
+    connection_pool.close_all()
+
+
+class DeferredRevert(object):
+    """Snapshot revert, postponed until environment is really needed
+
+    Revert is started in background thread with `start` and finished with
+    `wait`.
+    """
+
+    def __init__(self, env_name, snapshot_name):
+        self.env_name = env_name
+        self.snapshot_name = snapshot_name
+        self.thread = None
+        self.error = None
+
+    @property
+    def started(self):
+        return self.thread is not None
+
+    def _run(self):
+        try:
+            revert_snapshot(self.env_name, self.snapshot_name)
+        except Exception:
+            self.error = sys.exc_info()
+
+    def start(self):
+        if self.started:
+            return
+        logger.info('Start deferred revert of snapshot {}'.format(
+            self.snapshot_name))
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def wait(self):
+        self.start()
+        self.thread.join()
+        if self.error is not None:
+            six.reraise(*self.error)
+
+
+def schedule_revert(session, env_name, snapshot_name):
+    """Mark environment as requiring revert before next use"""
+    pending = getattr(session, 'pending_revert', None)
+    if pending is not None:
+        if not pending.started:
+            # single revert is enough for all accumulated changes
+            return
+        finish_revert(session)
+    session.pending_revert = DeferredRevert(env_name, snapshot_name)
+
+
+def finish_revert(session):
+    """Perform pending revert (if any) and wait for it"""
+    pending = getattr(session, 'pending_revert', None)
+    if pending is None:
+        return
+    try:
+        pending.wait()
+    finally:
+        session.pending_revert = None
+
+
+def get_guards_result(session, marker_str):
+    """Return cached result of `eval_guards_expression` or None
+
+    Results are cached per session (so per xdist worker), because `env`
+    fixture is session scoped and all tests of session use the same cluster.
+    """
+    return getattr(session, 'env_guards', {}).get(marker_str)
+
+
+def get_guards_skip_reason(marker_str, marker_str_evalued):
+    return 'Requires criteria: {}, computed instead: {}'.format(
+        marker_str, marker_str_evalued)
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_runtest_setup(item):
+    wait_timings.current_test = item.nodeid
+    if item.get_marker('skip') is not None:
+        return
+    # Skip by already known guards result before fixtures setup, so
+    # skipped test doesn't wait for pending revert
+    marker_str = get_guards_expression(item)
+    if marker_str is not None:
+        result = get_guards_result(item.session, marker_str)
+        if result is not None and not result[0]:
+            pytest.skip(get_guards_skip_reason(marker_str, result[1]))
+    # Start pending revert in background, while test fixtures are prepared
+    pending = getattr(item.session, 'pending_revert', None)
+    if pending is not None:
+        pending.start()
+
+
+def pytest_terminal_summary(terminalreporter):
+    count = terminalreporter.config.getoption('--slowest-waits')
+    if not count:
+        return
+    terminalreporter.write_sep('=', 'slowest {} waits'.format(count))
+    for line in wait_timings.report(count):
+        terminalreporter.write_line(line)
+
+
+def pytest_sessionfinish(session, exitstatus):
+    pending = getattr(session, 'pending_revert', None)
+    if pending is not None and pending.started:
+        finish_revert(session)
+    connection_pool.close_all()
 
 
 @pytest.fixture(scope="session", autouse=True)
@@ -139,8 +332,87 @@ def reinit_fixtures(request):
         fixturedef.cached_result = None
 
 
+def repair_network(request, networks_to_skip):
+    """Remove neutron resources, created by test"""
+    os_conn = request.getfuncargvalue('os_conn')
+    os_conn.cleanup_network(networks_to_skip=networks_to_skip)
+
+
+def wait_for_env_ready(request, env):
+    """Wait for OpenStack services readiness (and OSTF, if requested)"""
+    if request.config.getoption('--ostf-check'):
+        env.wait_for_ostf_pass()
+    env.wait_for_ready()
+
+
+def repair_services(request):
+    """Wait for restarted services to become ready"""
+    wait_for_env_ready(request, request.getfuncargvalue('env'))
+
+
+def repair_environment(request, scope, networks_to_skip):
+    """Try to repair environment without revert
+
+    :returns: True if environment is repaired
+    """
+    try:
+        if scope == 'network':
+            repair_network(request, networks_to_skip)
+        elif scope == 'service-restart':
+            repair_services(request)
+        else:
+            return False
+    except Exception:
+        logger.exception('Environment repair after {} failed, revert '
+                         'is required'.format(request.node.nodeid))
+        return False
+    logger.info('Environment repaired after {} (dirties {})'.format(
+        request.node.nodeid, scope))
+    return True
+
+
+def get_state_fingerprint(request):
+    """Return environment state fingerprint or None if it can't be taken"""
+    try:
+        return request.getfuncargvalue('env').get_state_fingerprint()
+    except Exception:
+        logger.exception("Can't take environment state fingerprint")
+        return None
+
+
+def is_state_changed(request, fingerprint):
+    """Check that environment state is changed since fingerprint was taken"""
+    current = None
+    if fingerprint is not None:
+        current = get_state_fingerprint(request)
+    if current is None:
+        logger.warning('Environment state after {} is unknown, it will be '
+                       'reverted'.format(request.node.nodeid))
+        return True
+    changed = request.getfuncargvalue('env').diff_fingerprints(fingerprint,
+                                                               current)
+    if changed:
+        logger.info('Environment state changed after {}: {}'.format(
+            request.node.nodeid, ', '.join(changed)))
+        return True
+    logger.info('Environment state is not changed after {}, revert is not '
+                'required'.format(request.node.nodeid))
+    return False
+
+
 @pytest.yield_fixture(autouse=True)
 def cleanup(request, env_name, snapshot_name):
+    scope = get_dirties_scope(request.node)
+    destructive = 'undestructive' not in request.node.keywords
+    networks_to_skip = ()
+    if scope == 'network':
+        os_conn = request.getfuncargvalue('os_conn')
+        networks_to_skip = [x['name'] for x in
+                            os_conn.neutron.list_networks()['networks']]
+    fingerprint = None
+    check_state = request.config.getoption('--check-dirty-state')
+    if destructive and check_state and all([env_name, snapshot_name]):
+        fingerprint = get_state_fingerprint(request)
     yield
     item = request.node
     if hasattr(item.session, 'nextitem') and item.session.nextitem is None:
@@ -151,12 +423,19 @@ def cleanup(request, env_name, snapshot_name):
     if request.config.option.exitfirst and failed:
         return
     skipped = any(x for x in test_results if x is not None and x.skipped)
-    destructive = 'undestructive' not in item.keywords
     reverted = False
     if destructive and not skipped:
-        if all([env_name, snapshot_name]):
-            revert_snapshot(env_name, snapshot_name)
-            reverted = True
+        # failed test can leave anything broken, so only full revert helps
+        repaired = False
+        if scope is not None and not failed:
+            repaired = repair_environment(request, scope, networks_to_skip)
+        if not repaired and all([env_name, snapshot_name]):
+            if is_state_changed(request, fingerprint):
+                schedule_revert(request.session, env_name, snapshot_name)
+                reverted = True
+    # revert, scheduled by one of previous tests, may be still pending
+    if getattr(request.session, 'pending_revert', None) is not None:
+        reverted = True
     setattr(request.session, 'reverted', reverted)
 
     # reinitialize fixtures
@@ -172,12 +451,13 @@ def get_fuel_client(fuel_ip):
 
 
 @pytest.fixture(scope="session")
-def credentials(setup_session, fuel_master_ip):
+def credentials(request, setup_session, fuel_master_ip):
     Credentials = namedtuple(
         'Credentials',
         ['fuel_ip', 'controller_ip', 'keystone_url', 'username', 'password',
             'project', 'cert'])
 
+    finish_revert(request.session)
     fuel = get_fuel_client(fuel_master_ip)
     env = fuel.get_last_created_cluster()
     controller_ip = env.get_primary_controller_ip()
@@ -200,8 +480,9 @@ def credentials(setup_session, fuel_master_ip):
 
 
 @pytest.fixture(scope='session')
-def fuel(fuel_master_ip):
+def fuel(request, fuel_master_ip):
     """Initialized fuel client"""
+    finish_revert(request.session)
     return get_fuel_client(fuel_master_ip)
 
 
@@ -219,16 +500,13 @@ def env(request, fuel):
         env = envs[0]
     assert env.is_operational
     if getattr(request.session, 'reverted', True):
-        env.wait_for_ostf_pass()
-        wait(env.os_conn.is_nova_ready,
-             timeout_seconds=60 * 5,
-             expected_exceptions=Exception,
-             waiting_for="OpenStack nova computes is ready")
+        wait_for_env_ready(request, env)
     return env
 
 
 @pytest.fixture(scope="session")
-def set_openstack_environ(fuel_master_ip):
+def set_openstack_environ(request, fuel_master_ip):
+    finish_revert(request.session)
     fuel = get_fuel_client(fuel_master_ip)
     env = fuel.get_last_created_cluster()
     """Set os.environ variables from openrc file"""
@@ -248,6 +526,7 @@ def set_openstack_environ(fuel_master_ip):
 
 @pytest.fixture(scope='class')
 def os_conn_for_unittests(request, fuel_master_ip):
+    finish_revert(request.session)
     fuel_client = get_fuel_client(fuel_master_ip)
     environment = fuel_client.get_last_created_cluster()
     request.cls.env = environment
@@ -382,19 +661,25 @@ def executable_requirements(request, env_name):
                 pytest.skip('requires {arg} executable'.format(arg=arg))
 
 
-@pytest.fixture(autouse=True)
-def env_requirements(request, env):
-    reserved = {'or', 'and', 'not', '(', ')'}
-    marker = request.node.get_marker('check_env_')
+def get_guards_expression(item):
+    """Return normalized `check_env_` marker expression or None"""
+    marker = item.get_marker('check_env_')
     if not marker:
-        return
+        return None
     marker_str = ' and '.join(marker.args)
-    marker_str = marker_str.replace(
+    return marker_str.replace(
         '(', ' ( '
     ).replace(
         ')', ' ) '
     ).replace(
         '  ', ' ')
+
+
+def eval_guards_expression(env, marker_str):
+    """Return result of guards expression and expression with guards
+    replaced by their values
+    """
+    reserved = {'or', 'and', 'not', '(', ')'}
     functions = marker_str.split()
     marker_str_evalued = marker_str
     for func in functions:
@@ -411,10 +696,27 @@ def env_requirements(request, env):
             raise ValueError('Parse error')
         marker_str_evalued = marker_str_evalued.replace(
             func, str(function(env)))
+    return eval(marker_str_evalued), marker_str_evalued
+
 
-    if not eval(marker_str_evalued):
-        pytest.skip('Requires criteria: {}, computed instead: {}'.format(
-            marker_str, marker_str_evalued))
+@pytest.fixture(autouse=True)
+def env_requirements(request):
+    marker_str = get_guards_expression(request.node)
+    if marker_str is None:
+        return
+    # Guards are evaluated once per expression for whole session, env is
+    # requested (and pending revert is finished) only for evaluation
+    result = get_guards_result(request.session, marker_str)
+    if result is None:
+        env = request.getfuncargvalue('env')
+        if not hasattr(request.session, 'env_guards'):
+            request.session.env_guards = {}
+        result = eval_guards_expression(env, marker_str)
+        request.session.env_guards[marker_str] = result
+    passed, marker_str_evalued = result
+
+    if not passed:
+        pytest.skip(get_guards_skip_reason(marker_str, marker_str_evalued))
 
 
 @pytest.fixture(autouse=True)
@@ -12,17 +12,32 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import json
 import logging
 
 from devops.models import Environment
 from devops.models import Interface
 
+from mos_tests.environment.ssh import CommandTimeoutExpired
+from mos_tests.environment.ssh import ParallelExecutor
+from mos_tests.environment.ssh import SSHClient
+from mos_tests.settings import SSH_CREDENTIALS
+
 logger = logging.getLogger(__name__)
 
 
 class EnvProxy(object):
     """Devops environment proxy model with some helpful methods"""
 
+    # Seconds to wait for time sync on each slave node
+    sync_time_timeout = 60
+    # Allowed clock difference between master and slaves after sync
+    max_clock_skew = 5
+    # Options of ssh from master to slaves: host keys may be changed after
+    # revert, and password prompt must not hang the command
+    ssh_options = ('-o ConnectTimeout=10 -o StrictHostKeyChecking=no '
+                   '-o UserKnownHostsFile=/dev/null -o BatchMode=yes')
+
     def __init__(self, env):
         self._env = env
 
@@ -136,15 +151,97 @@ class EnvProxy(object):
             logger.error('Can\'t revert snapshot due to error: {}'.format(e))
             raise
 
-    def sync_time(self):
-        with self.get_admin_remote() as remote:
-            slaves_count = len(self.nodes().all) - 1
+    def get_admin_ssh(self):
+        """Return SSHClient to Fuel master node"""
+        master = self.get_nodes(role__in=('fuel_master', 'admin'))[0]
+        return SSHClient(master.get_ip_address_by_network_name('admin'),
+                         username=SSH_CREDENTIALS['login'],
+                         password=SSH_CREDENTIALS['password'])
+
+    def get_slaves_ips(self, remote):
+        """Return admin ips of online slave nodes, registered in Fuel
+
+        If Fuel is not ready yet (right after resume, for example), admin
+        ips of devops slave nodes are returned.
+
+        :param remote: SSHClient to Fuel master node
+        """
+        result = remote.execute('fuel node --json', verbose=False)
+        if result.is_ok:
+            try:
+                nodes = json.loads(result.stdout_string)
+                return sorted(x['ip'] for x in nodes if x['online'])
+            except ValueError as e:
+                error = e
+        else:
+            error = result.stderr_string
+        logger.warning("Can't get nodes from Fuel ({}), use devops nodes "
+                       "ips".format(error))
+        slaves = self.get_nodes(role__in=('fuel_slave',))
+        ips = [x.get_ip_address_by_network_name('admin') for x in slaves]
+        return sorted(x for x in ips if x)
+
+    def sync_time(self, max_workers=8):
+        with self.get_admin_ssh() as remote:
             logger.info("sync time on master")
             remote.execute('hwclock --hctosys')
-            logger.info("sync time on {} slaves".format(slaves_count))
-            remote.execute('for i in {{1..{0}}}; '
-                           'do (ssh node-$i "hwclock --hctosys") done'.format(
-                               slaves_count))
+            ips = self.get_slaves_ips(remote)
+            logger.info("sync time on {} slaves".format(len(ips)))
+
+            def sync(ip):
+                command = 'ssh {opts} {ip} "hwclock --hctosys"'.format(
+                    opts=self.ssh_options, ip=ip)
+                try:
+                    result = remote.execute(command, verbose=False,
+                                            timeout=self.sync_time_timeout)
+                except CommandTimeoutExpired:
+                    result = None
+                if result is None or not result.is_ok:
+                    logger.warning("Can't sync time on {}".format(ip))
+
+            ParallelExecutor(max_workers=max_workers).map(sync, ips)
+            self.check_clock_skew(remote, ips)
+
+    def check_clock_skew(self, remote, ips):
+        """Check slaves clocks difference with master in one sweep
+
+        :param remote: SSHClient to Fuel master node
+        :return: dict with node ip as keys and skew in seconds as values,
+            empty dict if check failed
+        """
+        command = ('echo "start $(date +%s.%N)"; '
+                   'for ip in {ips}; do '
+                   '(echo "$ip $(ssh {opts} $ip date +%s.%N)") & '
+                   'done; wait; '
+                   'echo "end $(date +%s.%N)"').format(opts=self.ssh_options,
+                                                      ips=' '.join(ips))
+        try:
+            result = remote.execute(command, verbose=False,
+                                    timeout=self.sync_time_timeout)
+        except CommandTimeoutExpired:
+            logger.warning("Can't check clock skew: command timed out")
+            return {}
+        times = {}
+        for line in result.stdout_string.splitlines():
+            name, _, value = line.partition(' ')
+            try:
+                times[name] = float(value)
+            except ValueError:
+                logger.warning("Can't get time on {}".format(name))
+        if 'start' not in times or 'end' not in times:
+            logger.warning("Can't check clock skew: master time is absent in "
+                           "output")
+            return {}
+        start, end = times.pop('start'), times.pop('end')
+        skews = {ip: max(start - value, value - end, 0)
+                 for ip, value in times.items()}
+        unsynced = {ip: skew for ip, skew in skews.items()
+                    if skew > self.max_clock_skew}
+        if unsynced:
+            logger.warning('Clock skew is too big on nodes: {}'.format(
+                ', '.join('{0} ({1:.1f}s)'.format(*x)
+                          for x in sorted(unsynced.items()))))
+        return skews
 
 
 class DevopsClient(object):
@@ -12,9 +12,14 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+from collections import defaultdict
+import copy
+import functools
 from itertools import groupby
 import logging
 import os
+import re
+import time
 
 import dpath.util
 from fuelclient import client
@@ -26,6 +31,8 @@ from paramiko import RSAKey
 from paramiko import ssh_exception
 
 from mos_tests.environment.os_actions import OpenStackActions
+from mos_tests.environment.ssh import connection_pool
+from mos_tests.environment.ssh import ParallelExecutor
 from mos_tests.environment.ssh import SSHClient
 from mos_tests.functions.common import gen_temp_file
 from mos_tests.functions.common import wait
@@ -61,16 +68,22 @@ class NodeProxy(object):
         return [x['ip'].split('/')[0] for x in self.data['network_data']
                 if 'ip' in x]
 
-    def ssh(self):
+    def ssh(self, pooled=True):
+        """Return ssh client to node
+
+        :param pooled: share connection with other clients through session
+            connection pool
+        """
         return SSHClient(
             host=self.data['ip'],
             username='root',
-            private_keys=self._env.admin_ssh_keys
+            private_keys=self._env.admin_ssh_keys,
+            pool=connection_pool if pooled else None
         )
 
     def is_ssh_avaliable(self):
         try:
-            with self.ssh() as remote:
+            with self.ssh(pooled=False) as remote:
                 remote.check_call('uname')
         except (ssh_exception.SSHException,
                 ssh_exception.NoValidConnectionsError):
@@ -84,15 +97,48 @@ class NodeProxy(object):
                 for x in interfaces}
 
 
+class NodesInventory(object):
+    """Cluster nodes snapshot indexed by role, fqdn, ip and mac"""
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+        self.created_at = time.time()
+        self.by_fqdn = {x.data['fqdn']: x for x in nodes}
+        self.by_ip = {x.data['ip']: x for x in nodes}
+        self.by_mac = {x.data['mac']: x for x in nodes}
+        self.by_role = defaultdict(list)
+        for node in nodes:
+            for role in node.data['roles']:
+                self.by_role[role].append(node)
+
+    @property
+    def age(self):
+        return time.time() - self.created_at
+
+
 class Environment(environment.Environment):
     """Extended fuelclient Environment model with some helpful methods"""
 
     admin_ssh_keys = None
     _admin_ssh_keys_paths = None
+    # Seconds to use fetched nodes list without new request to Fuel API
+    nodes_cache_ttl = 10
+    # Daemons (children of init) with start time and services configs
+    # checksums, used in state fingerprint
+    node_state_command = (
+        "ps -eo ppid=,pid=,lstart=,args= | awk '$1 == 1'; "
+        "md5sum /etc/{nova,neutron,cinder,glance,keystone,heat}/*.conf "
+        "2>/dev/null")
+    # Pacemaker resources states without timestamps
+    pacemaker_state_command = (
+        "crm_mon -1 -r | grep -v -e 'Last updated' -e 'Last change'")
 
     def __init__(self, *args, **kwargs):
         super(Environment, self).__init__(*args, **kwargs)
         self._os_conn = None
+        self._inventory = None
+        self._settings_data = None
+        self._network_data = None
 
     @property
     def os_conn(self):
@@ -117,9 +163,80 @@ class Environment(environment.Environment):
                 self._admin_ssh_keys_paths.append(path)
         return self._admin_ssh_keys_paths
 
+    @property
+    def inventory(self):
+        """Cached indexed cluster nodes"""
+        inventory = self._inventory
+        if inventory is None or inventory.age > self.nodes_cache_ttl:
+            nodes = super(Environment, self).get_all_nodes()
+            self._inventory = NodesInventory(
+                [NodeProxy(x, self) for x in nodes])
+        return self._inventory
+
+    def refresh(self):
+        """Drop cached nodes, so next call will fetch them from Fuel"""
+        self._inventory = None
+
     def get_all_nodes(self):
-        nodes = super(Environment, self).get_all_nodes()
-        return [NodeProxy(x, self) for x in nodes]
+        return list(self.inventory.nodes)
+
+    def _lookup_node(self, index, key):
+        """Return node from inventory index (like 'by_ip') or None
+
+        Inventory is refreshed on miss, because node may be added or
+        changed after inventory was fetched.
+        """
+        node = getattr(self.inventory, index).get(key)
+        if node is None:
+            self.refresh()
+            node = getattr(self.inventory, index).get(key)
+        return node
+
+    def find_node_by_ip(self, ip):
+        return self._lookup_node('by_ip', ip)
+
+    def find_node_by_mac(self, mac):
+        return self._lookup_node('by_mac', mac)
+
+    def assign(self, nodes, roles):
+        try:
+            return super(Environment, self).assign(nodes, roles)
+        finally:
+            self.refresh()
+
+    def unassign(self, nodes):
+        try:
+            return super(Environment, self).unassign(nodes)
+        finally:
+            self.refresh()
+
+    def get_settings_data(self):
+        """Return cluster settings. Settings are fetched once and cached
+        until they are changed or cluster is deployed
+        """
+        if self._settings_data is None:
+            self._settings_data = super(Environment, self).get_settings_data()
+        return copy.deepcopy(self._settings_data)
+
+    def set_settings_data(self, *args, **kwargs):
+        self._settings_data = None
+        return super(Environment, self).set_settings_data(*args, **kwargs)
+
+    def get_network_data(self):
+        """Return cluster network configuration (cached like settings)"""
+        if self._network_data is None:
+            self._network_data = super(Environment, self).get_network_data()
+        return copy.deepcopy(self._network_data)
+
+    def set_network_data(self, *args, **kwargs):
+        self._network_data = None
+        return super(Environment, self).set_network_data(*args, **kwargs)
+
+    def deploy_changes(self, *args, **kwargs):
+        self._settings_data = None
+        self._network_data = None
+        self.refresh()
+        return super(Environment, self).deploy_changes(*args, **kwargs)
 
     def get_primary_controller_ip(self):
         """Return public ip of primary controller"""
@@ -127,16 +244,17 @@ class Environment(environment.Environment):
 
     def find_node_by_fqdn(self, fqdn):
         """Returns list of fuelclient.objects.Node instances for cluster"""
-        for node in self.get_all_nodes():
-            if node.data['fqdn'] == fqdn:
-                return node
-        raise Exception("Node doesn't found")
+        node = self._lookup_node('by_fqdn', fqdn)
+        if node is None:
+            raise Exception("Node doesn't found")
+        return node
 
-    def get_ssh_to_node(self, ip):
+    def get_ssh_to_node(self, ip, pooled=True):
         return SSHClient(
             host=ip,
             username='root',
-            private_keys=self.admin_ssh_keys
+            private_keys=self.admin_ssh_keys,
+            pool=connection_pool if pooled else None
         )
 
     def get_ssh_to_vm(self, ip, username=None, password=None,
@@ -147,8 +265,70 @@ class Environment(environment.Environment):
 
     def get_nodes_by_role(self, role):
         """Returns nodes by assigned role"""
-        return [x for x in self.get_all_nodes()
-                if role in x.data['roles']]
+        return list(self.inventory.by_role.get(role, []))
+
+    def run_on_role(self, role, command, **kwargs):
+        """Execute command on all nodes with role concurrently
+
+        :param kwargs: ParallelExecutor parameters (max_workers, timeout,
+            fail_fast)
+        :return: dict with node fqdn as keys and CommandResult as values
+        """
+        nodes = self.get_nodes_by_role(role)
+        remotes = [node.ssh() for node in nodes]
+        results = ParallelExecutor(**kwargs).execute(remotes, command)
+        return {node.data['fqdn']: results[remote.host]
+                for node, remote in zip(nodes, remotes)}
+
+    def _get_node_state(self, node, command):
+        with node.ssh() as remote:
+            result = remote.execute(command, verbose=False)
+        return result.stdout_string
+
+    def get_state_fingerprint(self):
+        """Return cheap snapshot of environment state
+
+        Fingerprint contains Fuel nodes statuses, OpenStack resources counts,
+        pacemaker resources states and daemons PIDs with start time and
+        OpenStack services configs checksums for each online node. All parts
+        are collected concurrently.
+
+        :return: dict with fingerprint part name as keys
+        """
+        self.refresh()
+        nodes = self.get_all_nodes()
+        probes = {
+            'nodes': lambda: sorted(
+                (x.data['fqdn'], x.data['online'], x.data['status'])
+                for x in nodes),
+            'openstack': self.os_conn.get_resources_counts,
+        }
+        online = [x for x in nodes if x.data['online']]
+        controllers = [x for x in online if 'controller' in x.data['roles']]
+        if controllers:
+            probes['pacemaker'] = functools.partial(
+                self._get_node_state, controllers[0],
+                self.pacemaker_state_command)
+        for node in online:
+            probes['node {}'.format(node.data['fqdn'])] = functools.partial(
+                self._get_node_state, node, self.node_state_command)
+
+        def take(name):
+            try:
+                return probes[name]()
+            except Exception as e:
+                logger.warning("Can't take {0} state: {1!r}".format(name, e))
+                raise
+
+        names = sorted(probes)
+        results = ParallelExecutor(fail_fast=True).map(take, names)
+        return dict(zip(names, results))
+
+    @staticmethod
+    def diff_fingerprints(before, after):
+        """Return sorted names of fingerprint parts which differ"""
+        return sorted(name for name in set(before) | set(after)
+                      if before.get(name) != after.get(name))
 
     def is_ostf_tests_pass(self, *test_groups):
         """Check for OpenStack tests pass"""
@@ -173,6 +353,105 @@ class Environment(environment.Environment):
                 return False
         return True
 
+    def _is_keystone_ready(self, os_conn):
+        os_conn.session.invalidate()
+        return os_conn.session.get_token() is not None
+
+    def _is_nova_ready(self, os_conn):
+        services = [x for x in os_conn.nova.services.list()
+                    if x.status == 'enabled']
+        if not all(x.state == 'up' for x in services):
+            return False
+        return os_conn.is_nova_ready()
+
+    def _is_neutron_ready(self, os_conn):
+        agents = os_conn.neutron.list_agents()['agents']
+        return all(x['alive'] for x in agents if x['admin_state_up'])
+
+    def _is_glance_ready(self, os_conn):
+        list(os_conn.glance.images.list())
+        return True
+
+    def _is_pacemaker_ready(self, controller):
+        with controller.ssh() as remote:
+            result = remote.execute('crm_mon -1', verbose=False, timeout=60)
+        output = result.stdout_string
+        return result.is_ok and not any(
+            x in output for x in (' FAILED', 'OFFLINE', 'UNCLEAN'))
+
+    def _is_rabbit_ready(self, controller):
+        with controller.ssh() as remote:
+            result = remote.execute('rabbitmqctl cluster_status',
+                                    verbose=False, timeout=60)
+        output = result.stdout_string
+        disc = re.search(r'\{disc,\[([^\]]*)\]', output)
+        running = re.search(r'\{running_nodes,\[([^\]]*)\]', output)
+        if not (result.is_ok and disc and running):
+            return False
+        nodes = set(re.findall(r"'([^']+)'", disc.group(1)))
+        running_nodes = set(re.findall(r"'([^']+)'", running.group(1)))
+        return nodes <= running_nodes
+
+    def get_readiness(self):
+        """Check OpenStack services health signals concurrently
+
+        :return: dict with signal name as keys and True/False (is ready) as
+            values
+        """
+        def check(probe):
+            try:
+                return bool(probe())
+            except Exception as e:
+                logger.debug('Readiness probe failed: {!r}'.format(e))
+                return False
+
+        # keystone is checked first, other OpenStack probes require it
+        try:
+            os_conn = self.os_conn
+        except Exception as e:
+            logger.debug("Can't init OpenStack clients: {!r}".format(e))
+            os_conn = None
+        probes = {}
+        if os_conn is not None:
+            probes.update({
+                'keystone': functools.partial(self._is_keystone_ready,
+                                              os_conn),
+                'nova': functools.partial(self._is_nova_ready, os_conn),
+                'neutron': functools.partial(self._is_neutron_ready, os_conn),
+                'glance': functools.partial(self._is_glance_ready, os_conn),
+            })
+        self.refresh()
+        controllers = [x for x in self.get_nodes_by_role('controller')
+                       if x.data['online']]
+        if controllers:
+            probes.update({
+                'pacemaker': functools.partial(self._is_pacemaker_ready,
+                                               controllers[0]),
+                'rabbitmq': functools.partial(self._is_rabbit_ready,
+                                              controllers[0]),
+            })
+        names = sorted(probes)
+        results = ParallelExecutor().map(lambda name: check(probes[name]),
+                                         names)
+        readiness = dict(zip(names, results))
+        if os_conn is None:
+            readiness['keystone'] = False
+        return readiness
+
+    def wait_for_ready(self, timeout_seconds=20 * 60, sleep_seconds=10):
+        """Wait until all OpenStack services health signals are green"""
+
+        def is_ready():
+            readiness = self.get_readiness()
+            not_ready = sorted(k for k, v in readiness.items() if not v)
+            if not_ready:
+                logger.debug('Not ready yet: {}'.format(', '.join(not_ready)))
+            return not not_ready
+
+        wait(is_ready, timeout_seconds=timeout_seconds,
+             sleep_seconds=sleep_seconds,
+             waiting_for='OpenStack services to be ready')
+
     def wait_for_ostf_pass(self):
         wait(self.is_ostf_tests_pass, timeout_seconds=20 * 60,
              sleep_seconds=20,
@@ -258,8 +537,10 @@ class Environment(environment.Environment):
     def destroy_nodes(self, devops_nodes):
         node_ips = [node.get_ip_address_by_network_name('admin')
                     for node in devops_nodes]
-        for node in devops_nodes:
+        for node, ip in zip(devops_nodes, node_ips):
             node.destroy()
+            connection_pool.discard(ip)
+        self.refresh()
         wait(lambda: self.check_nodes_get_offline_state(node_ips),
              timeout_seconds=10 * 60,
              waiting_for='the nodes get offline state')
@@ -286,6 +567,7 @@ class Environment(environment.Environment):
         for node in devops_nodes:
             logger.info('Starting node {}'.format(node.name))
             node.create()
+        self.refresh()
         wait(self.check_nodes_get_online_state, timeout_seconds=10 * 60)
         logger.info('wait until the nodes get online state')
         for node in self.get_all_nodes():
@@ -299,21 +581,21 @@ class Environment(environment.Environment):
         self.warm_start_nodes(devops_nodes)
 
     def check_nodes_get_offline_state(self, node_ips=()):
+        self.refresh()
         nodes_states = [not x.data['online']
                         for x in self.get_all_nodes()
                         if x.data['ip'] in node_ips]
         return all(nodes_states)
 
     def check_nodes_get_online_state(self):
+        self.refresh()
         return all([node.data['online'] for node in self.get_all_nodes()])
 
     def get_node_ip_by_host_name(self, hostname):
-        controller_ip = ''
-        for node in self.get_all_nodes():
-            if node.data['fqdn'] == hostname:
-                controller_ip = node.data['ip']
-                break
-        return controller_ip
+        node = self._lookup_node('by_fqdn', hostname)
+        if node is None:
+            return ''
+        return node.data['ip']
 
     def get_node_by_devops_node(self, devops_node, interface='admin'):
         interfaces = devops_node.interface_by_network_name(interface)
@@ -403,7 +685,8 @@ class FuelClient(object):
     def ssh_admin(self):
         return SSHClient(host=self.admin_ip,
                          username=self.ssh_login,
-                         password=self.ssh_password)
+                         password=self.ssh_password,
+                         pool=connection_pool)
 
     @property
     def admin_keys(self):
@@ -12,8 +12,12 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+from collections import defaultdict
+from collections import deque
 import logging
 import random
+import threading
+import time
 
 from cinderclient import client as cinderclient
 from glanceclient.v2.client import Client as GlanceClient
@@ -27,9 +31,13 @@ from novaclient import client as nova_client
 from novaclient import exceptions as nova_exceptions
 import paramiko
 import six
+from waiting import TimeoutExpired
 
+from mos_tests.environment.ssh import NetnsProxy
+from mos_tests.environment.ssh import ParallelExecutor
 from mos_tests.environment.ssh import SSHClient
 from mos_tests.functions.common import gen_temp_file
+from mos_tests.functions.common import ServersPoller
 from mos_tests.functions.common import wait
 from mos_tests.functions import os_cli
 
@@ -46,9 +54,37 @@ class InstanceError(Exception):
                 '{0.fault[details]}'.format(self.instance))
 
 
+class PortsIndex(object):
+    """Neutron ports snapshot indexed by fixed ip, mac and device id"""
+
+    def __init__(self, ports):
+        self.ports = ports
+        self.created_at = time.time()
+        self.by_ip = {}
+        self.by_mac = {x['mac_address']: x for x in ports}
+        self.by_device = defaultdict(list)
+        for port in ports:
+            self.by_device[port['device_id']].append(port)
+            for fixed_ip in port['fixed_ips']:
+                self.by_ip[fixed_ip['ip_address']] = port
+
+    @property
+    def age(self):
+        return time.time() - self.created_at
+
+
 class OpenStackActions(object):
     """OpenStack base services clients and helper actions"""
 
+    # Port lookups count in `ports_burst_window` seconds, after which single
+    # list of all ports is used instead of filtered requests
+    ports_burst_size = 5
+    ports_burst_window = 10
+    # Seconds to use ports index
+    ports_index_ttl = 5
+    # Max count of ids in one filtered list request
+    filter_chunk_size = 50
+
     def __init__(self, controller_ip, user='admin', password='admin',
                  tenant='admin', cert=None, env=None, proxy_session=None):
         logger.debug('Init OpenStack clients on {0}'.format(controller_ip))
@@ -95,6 +131,28 @@ class OpenStackActions(object):
         self.heat = HeatClient(endpoint=endpoint_url, token=token)
 
         self.env = env
+        # Shared servers statuses poller
+        self.servers_poller = ServersPoller(self.nova)
+        # Connections to nodes, used as jump hosts to reach instances
+        self._jump_hosts = {}
+        self._jump_hosts_lock = threading.Lock()
+        # Instances network data and dhcp hosts by instance id
+        self._vm_access = {}
+        # Nodes ips by fqdn
+        self._node_ips = {}
+        self._ports_index = None
+        self._port_lookups = deque()
+
+    def _get_jump_host(self, env, ip):
+        """Return SSHClient to node for tunneling to instances
+
+        Client is shared between threads, it's connected (and reconnected)
+        by NetnsProxy under client `connect_lock`.
+        """
+        with self._jump_hosts_lock:
+            if ip not in self._jump_hosts:
+                self._jump_hosts[ip] = env.get_ssh_to_node(ip)
+            return self._jump_hosts[ip]
 
     def _get_cirros_image(self):
         for image in self.glance.images.list():
@@ -107,6 +165,33 @@ class OpenStackActions(object):
         return all(x['available'] for y in hosts.values()
                    for x in y.values() if x['active'])
 
+    def get_resources_counts(self):
+        """Return count of each OpenStack resource type in all tenants"""
+        all_tenants = {'all_tenants': 1}
+        listers = {
+            'servers': lambda: self.nova.servers.list(
+                search_opts=all_tenants),
+            'flavors': lambda: self.nova.flavors.list(is_public=None),
+            'keypairs': self.nova.keypairs.list,
+            'volumes': lambda: self.cinder.volumes.list(
+                search_opts=all_tenants),
+            'images': lambda: list(self.glance.images.list()),
+            'tenants': self.keystone.tenants.list,
+            'users': self.keystone.users.list,
+            'networks': lambda: self.neutron.list_networks()['networks'],
+            'subnets': lambda: self.neutron.list_subnets()['subnets'],
+            'routers': lambda: self.neutron.list_routers()['routers'],
+            'ports': lambda: self.neutron.list_ports()['ports'],
+            'floatingips': lambda: self.neutron.list_floatingips()[
+                'floatingips'],
+            'security_groups': lambda: self.neutron.list_security_groups()[
+                'security_groups'],
+        }
+        names = sorted(listers)
+        results = ParallelExecutor(fail_fast=True).map(
+            lambda name: len(listers[name]()), names)
+        return dict(zip(names, results))
+
     def get_instance_detail(self, server):
         details = self.nova.servers.get(server)
         return details
@@ -129,6 +214,23 @@ class OpenStackActions(object):
     def is_server_active(self, server):
         return self.server_status_is(server, 'ACTIVE')
 
+    def wait_servers_active(self, servers, timeout=300, waiting_for=None):
+        """Wait for servers to become ACTIVE with batched status polling
+
+        :param servers: list of servers or servers ids
+        :return: list of updated servers
+        """
+        futures = [self.servers_poller.watch(getattr(x, 'id', x))
+                   for x in servers]
+        waiting_for = waiting_for or '{} instances change status to ' \
+                                     'ACTIVE'.format(len(futures))
+        servers = self.servers_poller.wait(futures, timeout_seconds=timeout,
+                                           waiting_for=waiting_for)
+        for server in servers:
+            if server.status == 'ERROR':
+                raise InstanceError(server)
+        return servers
+
     def create_server(self, name, image_id=None, flavor=1, userdata=None,
                       files=None, key_name=None, timeout=300,
                       wait_for_active=True, wait_for_avaliable=True, **kwargs):
@@ -144,9 +246,9 @@ class OpenStackActions(object):
                                        **kwargs)
 
         if wait_for_active:
-            wait(lambda: self.is_server_active(srv),
-                 timeout_seconds=timeout, sleep_seconds=5,
-                 waiting_for='instance {0} changes status to ACTIVE'.format(
+            self.wait_servers_active(
+                [srv], timeout=timeout,
+                waiting_for='instance {0} changes status to ACTIVE'.format(
                     name))
 
         # wait for ssh ready
@@ -156,6 +258,8 @@ class OpenStackActions(object):
                      timeout_seconds=timeout,
                      waiting_for='server available via ssh')
             logger.info('the server {0} is ready'.format(srv.name))
+        # server ports are created by nova during boot
+        self.invalidate_ports_index()
         return self.get_instance_detail(srv.id)
 
     def is_server_ssh_ready(self, server):
@@ -180,6 +284,8 @@ class OpenStackActions(object):
                 raise InstanceError(instance)
             return False
         except nova_exceptions.NotFound:
+            self.invalidate_ports_index()
+            self.invalidate_vm_access_cache(server_id)
             return True
 
     def get_nova_instance_ips(self, srv):
@@ -237,10 +343,12 @@ class OpenStackActions(object):
         return self.neutron.list_networks_on_dhcp_agent(agent_id)
 
     def add_network_to_dhcp_agent(self, agent_id, network_id):
+        self._invalidate_network_access(network_id)
         self.neutron.add_network_to_dhcp_agent(
             agent_id, body={'network_id': network_id})
 
     def remove_network_from_dhcp_agent(self, agent_id, network_id):
+        self._invalidate_network_access(network_id)
         self.neutron.remove_network_from_dhcp_agent(agent_id, network_id)
 
     def add_router_to_l3_agent(self, router_id, l3_agent_id):
@@ -256,6 +364,7 @@ class OpenStackActions(object):
             network_id=network_id, device_owner=device_owner)['ports']
 
     def create_port(self, network_id):
+        self.invalidate_ports_index()
         return self.neutron.create_port({'port': {'network_id': network_id}})
 
     def list_l3_agents(self):
@@ -278,6 +387,7 @@ class OpenStackActions(object):
         return self.neutron.create_network({'network': network})
 
     def delete_network(self, id):
+        self.invalidate_ports_index()
         return self.neutron.delete_network(id)
 
     def create_subnet(self, network_id, name, cidr, tenant_id=None,
@@ -384,6 +494,7 @@ class OpenStackActions(object):
             body['port_id'] = port_id
         else:
             raise ValueError("subnet_id or port_id must be indicated.")
+        self.invalidate_ports_index()
         self.neutron.add_interface_router(router_id, body)
 
     def router_interface_delete(self, router_id, subnet_id=None, port_id=None):
@@ -394,6 +505,7 @@ class OpenStackActions(object):
             body['port_id'] = port_id
         else:
             raise ValueError("subnet_id or port_id must be indicated.")
+        self.invalidate_ports_index()
         self.neutron.remove_interface_router(router_id, body)
 
     def router_gateway_add(self, router_id, network_id):
@@ -454,12 +566,48 @@ class OpenStackActions(object):
     def delete_key(self, key_name):
         return self.nova.keypairs.delete(key_name)
 
+    def _get_ports_index(self):
+        """Return ports index if lookups burst is detected, otherwise None"""
+        now = time.time()
+        index = self._ports_index
+        if index is not None and index.age < self.ports_index_ttl:
+            return index
+        self._port_lookups.append(now)
+        while self._port_lookups[0] < now - self.ports_burst_window:
+            self._port_lookups.popleft()
+        if len(self._port_lookups) < self.ports_burst_size:
+            return None
+        self._port_lookups.clear()
+        self._ports_index = PortsIndex(self.neutron.list_ports()['ports'])
+        return self._ports_index
+
+    def invalidate_ports_index(self):
+        self._ports_index = None
+
     def get_port_by_fixed_ip(self, ip):
         """Returns neutron port by instance fixed ip"""
-        for port in self.neutron.list_ports()['ports']:
-            for ips in port['fixed_ips']:
-                if ip == ips['ip_address']:
-                    return port
+        index = self._get_ports_index()
+        if index is not None and ip in index.by_ip:
+            return index.by_ip[ip]
+        # index may be outdated, so not found port is requested directly
+        ports = self.neutron.list_ports(
+            fixed_ips='ip_address={}'.format(ip))['ports']
+        if ports:
+            return ports[0]
+
+    def _list_by_networks(self, resource, networks):
+        """List neutron resources of networks with server-side filter
+
+        :param resource: 'ports' or 'subnets'
+        :param networks: list of networks ids
+        """
+        lister = getattr(self.neutron, 'list_{}'.format(resource))
+        networks = list(networks)
+        result = []
+        for i in range(0, len(networks), self.filter_chunk_size):
+            chunk = networks[i:i + self.filter_chunk_size]
+            result.extend(lister(network_id=chunk)[resource])
+        return result
 
     @property
     def ext_network(self):
@@ -468,10 +616,7 @@ class OpenStackActions(object):
         return ext_networks['networks'][0]
 
     def delete_subnets(self, networks):
-        # Subnets and ports are simply filtered by network ids
-        for subnet in self.neutron.list_subnets()['subnets']:
-            if subnet['network_id'] not in networks:
-                continue
+        for subnet in self._list_by_networks('subnets', networks):
             try:
                 self.neutron.delete_subnet(subnet['id'])
             except NeutronClientException:
@@ -502,6 +647,8 @@ class OpenStackActions(object):
                 self.nova.servers.delete(server)
             except nova_exceptions.ClientException:
                 logger.info('nova server {} is not deletable'.format(server))
+        self.invalidate_ports_index()
+        self.invalidate_vm_access_cache()
 
     def delete_keypairs(self):
         for key_pair in self.nova.keypairs.list():
@@ -527,9 +674,7 @@ class OpenStackActions(object):
         # TBD some ports are still kept after the cleanup.
         # Need to find why and delete them as well
         # But it does not fail the execution so far.
-        for port in self.neutron.list_ports()['ports']:
-            if port['network_id'] not in networks:
-                continue
+        for port in self._list_by_networks('ports', networks):
             try:
                 # TBD Looks like the port might be used either by router or
                 # l3 agent
@@ -547,37 +692,121 @@ class OpenStackActions(object):
             except NeutronClientException:
                 logger.info('the port {} is not deletable'
                             .format(port['id']))
+        self.invalidate_ports_index()
 
-    def cleanup_network(self, networks_to_skip=tuple()):
-        """Clean up the neutron networks.
+    def _delete_concurrently(self, groups, max_workers=10):
+        """Delete resources concurrently, ignoring already deleted ones
 
-        :param networks_to_skip: list of networks names that should be kept
+        :param groups: list of (kind, resources, delete) tuples, where `kind`
+            is a resource type name for report and `delete` is a function
+            to delete single resource
+        :return: list of descriptions of resources, which can't be deleted
         """
-        # net ids with the names from networks_to_skip are filtered out
-        networks = [x['id'] for x in self.neutron.list_networks()['networks']
-                    if x['name'] not in networks_to_skip]
-
-        self.delete_keypairs()
-
-        self.delete_floating_ips()
+        def safe_delete(job):
+            kind, resource, delete = job
+            try:
+                delete(resource)
+            except (NeutronClientException,
+                    nova_exceptions.ClientException) as e:
+                if getattr(e, 'status_code', getattr(e, 'code', None)) == 404:
+                    return
+                resource_id = getattr(resource, 'id', None) or resource['id']
+                return '{} {}: {}'.format(kind, resource_id, e)
+
+        jobs = [(kind, resource, delete)
+                for kind, resources, delete in groups
+                for resource in resources]
+        results = ParallelExecutor(max_workers=max_workers).map(safe_delete,
+                                                                jobs)
+        return [x for x in results if x is not None]
+
+    def _delete_floating_ip(self, floating_ip):
+        try:
+            self.nova.floating_ips.delete(floating_ip)
+        except nova_exceptions.ClientException:
+            self.neutron.delete_floatingip(floating_ip.id)
 
-        self.delete_servers()
+    def _wait_servers_deleted(self, servers, timeout=5 * 60):
+        """Wait servers deletion with single servers list request per tick
 
-        self.delete_security_groups()
+        :return: list of descriptions of servers, which are not deleted
+        """
+        ids = {x.id for x in servers}
 
-        self.delete_ports(networks)
+        def remaining():
+            return ids & {x.id for x in self.nova.servers.list()}
 
-        self.delete_subnets(networks)
+        try:
+            wait(lambda: not remaining(), timeout_seconds=timeout,
+                 sleep_seconds=2,
+                 waiting_for='{} servers to be deleted'.format(len(ids)))
+        except TimeoutExpired:
+            return ['server {}: not deleted in {}s'.format(x, timeout)
+                    for x in sorted(remaining())]
+        return []
+
+    def cleanup_network(self, networks_to_skip=tuple(), max_workers=10):
+        """Clean up the neutron networks.
 
-        self.delete_routers()
+        All resources are listed once, then deleted layer by layer (from
+        dependent resources to networks), each layer concurrently.
 
-        # Delete nets
-        for net in networks:
-            try:
-                self.neutron.delete_network(net)
-            except NeutronClientException:
-                logger.info('the net {} is not deletable'
-                            .format(net))
+        :param networks_to_skip: list of networks names that should be kept
+        :param max_workers: max count of concurrent delete requests
+        :return: list of descriptions of resources, which can't be deleted
+        """
+        # net ids with the names from networks_to_skip are filtered out
+        networks = [x for x in self.neutron.list_networks()['networks']
+                    if x['name'] not in networks_to_skip]
+        net_ids = {x['id'] for x in networks}
+        ports = self._list_by_networks('ports', net_ids)
+        subnets = self._list_by_networks('subnets', net_ids)
+        # Did not find the better way to detect the fuel admin router
+        # Looks like it just always has fixed name router04
+        routers = [x for x in self.neutron.list_routers()['routers']
+                   if x['name'] != 'router04']
+        servers = self.nova.servers.list()
+        security_groups = [
+            x for x in self.nova.security_groups.list()
+            if x.description != 'Default security group']
+        router_ports = [
+            x for x in ports
+            if x['device_owner'].startswith('network:router_interface')]
+        # ports, created directly (not by nova or neutron agents)
+        free_ports = [x for x in ports if not x['device_owner']]
+
+        def delete_layer(*groups):
+            return self._delete_concurrently(groups, max_workers=max_workers)
+
+        failed = []
+        failed += delete_layer(
+            ('server', servers, self.nova.servers.delete),
+            ('keypair', self.nova.keypairs.list(), self.nova.keypairs.delete),
+            ('floating ip', self.nova.floating_ips.list(),
+             self._delete_floating_ip))
+        failed += self._wait_servers_deleted(servers)
+        failed += delete_layer(
+            ('security group', security_groups,
+             self.nova.security_groups.delete),
+            ('router interface', router_ports,
+             lambda x: self.neutron.remove_interface_router(
+                 x['device_id'], {'port_id': x['id']})),
+            ('port', free_ports,
+             lambda x: self.neutron.delete_port(x['id'])))
+        failed += delete_layer(
+            ('subnet', subnets, lambda x: self.neutron.delete_subnet(x['id'])))
+        failed += delete_layer(
+            ('router', routers, lambda x: self.neutron.delete_router(x['id'])))
+        failed += delete_layer(
+            ('network', networks,
+             lambda x: self.neutron.delete_network(x['id'])))
+
+        self.invalidate_ports_index()
+        self.invalidate_vm_access_cache()
+        if failed:
+            logger.warning('Not deleted during cleanup:\n{}'.format(
+                '\n'.join(failed)))
+        return failed
 
     def execute_through_host(self, ssh, vm_host, cmd, creds=()):
         logger.debug("Making intermediate transport")
@@ -618,46 +847,93 @@ class OpenStackActions(object):
 
         return result
 
-    def ssh_to_instance(self, env, vm, vm_keypair=None, username='cirros',
-                        password=None, proxy_node=None):
-        """Returns direct ssh client to instance via proxy"""
+    def invalidate_vm_access_cache(self, vm=None):
+        """Drop cached data to reach instance (all instances if vm is None)
+
+        :param vm: nova server or its id
+        """
+        if vm is None:
+            self._vm_access.clear()
+            self._node_ips.clear()
+        else:
+            self._vm_access.pop(getattr(vm, 'id', vm), None)
+
+    def _invalidate_network_access(self, net_id):
+        for vm_id, access in list(self._vm_access.items()):
+            if access['net_id'] == net_id:
+                del self._vm_access[vm_id]
+
+    def _get_vm_access(self, vm):
+        """Return ip, network id and dhcp hosts for instance
+
+        Network id and dhcp hosts are cached while instance has the same
+        port (mac and ip).
+        """
         # Update vm data
         vm.get()
-        logger.debug('Try to connect to vm {0}'.format(vm.name))
         net_name = [x for x in vm.addresses if len(vm.addresses[x]) > 0][0]
-        vm_ip = vm.addresses[net_name][0]['addr']
         vm_mac = vm.addresses[net_name][0]['OS-EXT-IPS-MAC:mac_addr']
+        vm_ip = vm.addresses[net_name][0]['addr']
+        access = self._vm_access.get(vm.id)
+        if access is not None and (access['mac'], access['vm_ip']) == (
+                vm_mac, vm_ip):
+            return access
         net_id = self.neutron.list_ports(
             mac_address=vm_mac)['ports'][0]['network_id']
+        access = {
+            'vm_ip': vm_ip,
+            'mac': vm_mac,
+            'net_id': net_id,
+            'dhcp_hosts': self.get_node_with_dhcp_for_network(net_id),
+        }
+        if access['dhcp_hosts']:
+            self._vm_access[vm.id] = access
+        return access
+
+    def _get_node_ip(self, env, fqdn):
+        if fqdn not in self._node_ips:
+            self._node_ips[fqdn] = env.find_node_by_fqdn(fqdn).data['ip']
+        return self._node_ips[fqdn]
+
+    def ssh_to_instance(self, env, vm, vm_keypair=None, username='cirros',
+                        password=None, proxy_node=None):
+        """Returns direct ssh client to instance via proxy"""
+        logger.debug('Try to connect to vm {0}'.format(vm.name))
+        access = self._get_vm_access(vm)
+        vm_ip = access['vm_ip']
+        net_id = access['net_id']
         dhcp_namespace = "qdhcp-{0}".format(net_id)
         if proxy_node is None:
-            proxy_nodes = self.get_node_with_dhcp_for_network(net_id)
+            proxy_nodes = access['dhcp_hosts']
             if not proxy_nodes:
                 raise Exception("Nodes with dhcp for network with id:{}"
                                 " not found.".format(net_id))
         else:
             proxy_nodes = [proxy_node]
 
-        proxy_commands = []
+        proxy_sockets = []
         for node in proxy_nodes:
-            ip = env.find_node_by_fqdn(node).data['ip']
-            key_paths = env.admin_ssh_keys_paths
-            proxy_command = (
-                "ssh {keys} -o 'StrictHostKeyChecking no' "
-                "root@{node_ip} 'ip netns exec {ns} "
-                "nc {vm_ip} 22'".format(
-                    keys=' '.join('-i {}'.format(k) for k in key_paths),
-                    ns=dhcp_namespace,
-                    node_ip=ip,
-                    vm_ip=vm_ip))
-            proxy_commands.append(proxy_command)
+            ip = self._get_node_ip(env, node)
+            proxy_sockets.append(NetnsProxy(self._get_jump_host(env, ip),
+                                            namespace=dhcp_namespace,
+                                            host=vm_ip))
         instance_keys = []
         if vm_keypair is not None:
             instance_keys.append(paramiko.RSAKey.from_private_key(
                 six.StringIO(vm_keypair.private_key)))
+
+        def on_connect_error(e):
+            # Instance is reachable, if it rejects credentials
+            if isinstance(e, paramiko.AuthenticationException):
+                return
+            # Dhcp agent may be rescheduled or instance address changed,
+            # so look for them on next connect
+            self.invalidate_vm_access_cache(vm)
+
         return SSHClient(vm_ip, port=22, username=username, password=password,
                          private_keys=instance_keys,
-                         proxy_commands=proxy_commands)
+                         proxy_sockets=proxy_sockets,
+                         on_connect_error=on_connect_error)
 
     def wait_agents_alive(self, agt_ids_to_check):
         wait(lambda: all(agt['alive'] for agt in
@@ -739,6 +1015,7 @@ class OpenStackActions(object):
     def force_dhcp_reschedule(self, net_id, new_dhcp_agt_id):
         logger.info('going to reschedule network to specified '
                     'controller dhcp agent')
+        self._invalidate_network_access(net_id)
         current_dhcp_agt_id = self.neutron.list_dhcp_agent_hosting_networks(
             net_id)['agents'][0]['id']
         self.neutron.remove_network_from_dhcp_agent(current_dhcp_agt_id,
@@ -794,6 +1071,7 @@ class OpenStackActions(object):
             logger.info("nova server {} can't be stopped".format(server))
 
     def rebuild_server(self, server, image):
+        self.invalidate_vm_access_cache(server)
         srv = server.rebuild(image)
         wait(lambda: self.nova.servers.get(srv).status == 'REBUILD',
              timeout_seconds=60, waiting_for='start of instance rebuild')
@@ -12,12 +12,20 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+from collections import defaultdict
+from collections import namedtuple
 import functools
+import hashlib
 import logging
+from multiprocessing.pool import ThreadPool
 import os
 import posixpath
 import select
+import shutil
 import stat
+import sys
+import tarfile
+import threading
 import time
 
 import paramiko
@@ -70,6 +78,33 @@ class CalledProcessError(Exception):
         return message
 
 
+@six.python_2_unicode_compatible
+class CommandTimeoutExpired(Exception):
+    def __init__(self, command, timeout):
+        self.cmd = command
+        self.timeout = timeout
+
+    def __str__(self):
+        return u"Command '{0}' timed out after {1} seconds".format(
+            self.cmd, self.timeout)
+
+
+class TransferStats(namedtuple('TransferStats', ['direction', 'host',
+                                                  'source', 'target',
+                                                  'size', 'seconds'])):
+    """File transfer metrics. `size` is count of transferred bytes"""
+
+    @property
+    def speed(self):
+        """Bytes per second"""
+        return self.size / max(self.seconds, 1e-6)
+
+
+# Callables, which will be called with TransferStats after each sftp
+# file transfer
+transfer_hooks = []
+
+
 class CommandResult(dict):
 
     @property
@@ -88,8 +123,208 @@ class CommandResult(dict):
         return self._list_to_string('stderr')
 
 
+class PooledConnection(object):
+    """Authenticated ssh connection shared between SSHClient instances"""
+
+    def __init__(self, key, ssh):
+        self.key = key
+        self.ssh = ssh
+        self.users = 0
+        self.last_used = time.time()
+        self.last_checked = self.last_used
+
+    @property
+    def host(self):
+        return self.key[0]
+
+    def is_alive(self):
+        transport = self.ssh.get_transport()
+        if transport is None:
+            return False
+        return transport.is_active() and transport.is_authenticated()
+
+    def probe(self, timeout=5):
+        """Check that remote side still answers by opening a new channel"""
+        try:
+            chan = self.ssh.get_transport().open_session(timeout=timeout)
+            chan.close()
+        except Exception as e:
+            logger.debug('Pooled connection to {0} is broken: {1}'.format(
+                self.host, e))
+            return False
+        self.last_checked = time.time()
+        return True
+
+    def close(self):
+        try:
+            self.ssh.close()
+        except Exception:
+            logger.exception("Could not close pooled ssh connection")
+
+
+class SSHConnectionPool(object):
+    """Session-wide pool of authenticated ssh connections
+
+    Connections are keyed by (host, port, username, proxy_commands) and are
+    shared by all SSHClient instances with the same key, so each command
+    runs as a new channel on already established transport instead of doing
+    full TCP handshake, key exchange and authentication again.
+
+    :param max_per_host: maximum count of connections to a single host
+    :param max_users: count of clients sharing one connection before a new
+        connection to the same host will be opened
+    :param max_idle: seconds after which unused connection will be closed
+    :param check_interval: seconds after which connection will be probed
+        with a new channel before reuse
+    :param keepalive: transport keepalive interval in seconds
+    """
+
+    def __init__(self, max_per_host=2, max_users=8, max_idle=5 * 60,
+                 check_interval=10, keepalive=30):
+        self.max_per_host = max_per_host
+        self.max_users = max_users
+        self.max_idle = max_idle
+        self.check_interval = check_interval
+        self.keepalive = keepalive
+        self._lock = threading.Lock()
+        # Notified when pending connection is opened or failed
+        self._connected = threading.Condition(self._lock)
+        self._connections = defaultdict(list)
+        # Count of connections being opened now by key
+        self._pending = defaultdict(int)
+
+    def _host_connections_count(self, host):
+        """Return count of opened and pending connections to host. Must be
+        called under lock
+        """
+        opened = sum(len(conns) for key, conns in self._connections.items()
+                     if key[0] == host)
+        pending = sum(count for key, count in self._pending.items()
+                      if key[0] == host)
+        return opened + pending
+
+    def _evict(self):
+        """Drop dead and idle connections. Must be called under lock"""
+        now = time.time()
+        for key, conns in list(self._connections.items()):
+            for conn in conns[:]:
+                idle = conn.users == 0 and now - conn.last_used > self.max_idle
+                if idle or not conn.is_alive():
+                    logger.debug('Evict pooled connection to {0}'.format(
+                        conn.host))
+                    conns.remove(conn)
+                    if conn.users == 0:
+                        conn.close()
+            if not conns:
+                del self._connections[key]
+
+    def _pick(self, key):
+        """Return most free connection for key or None if new connection
+        should be opened. Must be called under lock
+        """
+        conns = self._connections.get(key, [])
+        if not conns:
+            return None
+        conn = min(conns, key=lambda x: x.users)
+        host_is_full = (
+            self._host_connections_count(key[0]) >= self.max_per_host)
+        if conn.users >= self.max_users and not host_is_full:
+            return None
+        return conn
+
+    def acquire(self, key, connect):
+        """Return PooledConnection for key
+
+        :param key: connection key tuple, first element should be host
+        :param connect: callable, which returns new connected
+            paramiko.SSHClient instance
+        """
+        with self._lock:
+            while True:
+                self._evict()
+                conn = self._pick(key)
+                if conn is not None:
+                    conn.users += 1
+                    break
+                count = self._host_connections_count(key[0])
+                if not self._pending.get(key) or count < self.max_per_host:
+                    # reserve slot before connect, so concurrent callers
+                    # don't exceed max_per_host
+                    self._pending[key] += 1
+                    break
+                # wait for connection, which is being opened by other caller
+                self._connected.wait(1)
+        if conn is not None:
+            stale = time.time() - conn.last_checked > self.check_interval
+            if not stale or conn.probe():
+                logger.debug('Reuse pooled connection to {0}'.format(key[0]))
+                return conn
+            self.release(conn)
+            self.discard(key[0])
+            return self.acquire(key, connect)
+
+        conn = None
+        try:
+            ssh = connect()
+            ssh.get_transport().set_keepalive(self.keepalive)
+            conn = PooledConnection(key, ssh)
+            conn.users += 1
+        finally:
+            with self._lock:
+                self._pending[key] -= 1
+                if not self._pending[key]:
+                    del self._pending[key]
+                if conn is not None:
+                    self._connections[key].append(conn)
+                self._connected.notify_all()
+        return conn
+
+    def release(self, conn):
+        with self._lock:
+            conn.users -= 1
+            conn.last_used = time.time()
+            pooled = conn in self._connections.get(conn.key, [])
+        if not pooled and conn.users == 0:
+            conn.close()
+
+    def discard(self, host):
+        """Close all connections to host (after node reboot, for example)"""
+        with self._lock:
+            for key in [x for x in self._connections if x[0] == host]:
+                for conn in self._connections.pop(key):
+                    if conn.users == 0:
+                        conn.close()
+
+    def close_all(self):
+        """Close all pooled connections (after snapshot revert, for example)"""
+        with self._lock:
+            connections = self._connections
+            self._connections = defaultdict(list)
+        for conns in connections.values():
+            for conn in conns:
+                if conn.users == 0:
+                    conn.close()
+
+
+# Session-wide pool for connections to fuel master and slave nodes
+connection_pool = SSHConnectionPool()
+
+
 class SSHClient(object):
 
+    # Size of single read from channel in bytes
+    recv_size = 64 * 1024
+    # Max time to wait for new channel data before recheck channel state
+    select_timeout = 5
+    # Channel window size for sftp file transfers
+    sftp_window_size = 64 * 1024 * 1024
+    # Size of single sftp read/write request
+    sftp_request_size = 32 * 1024
+    # Count of read requests sent without waiting for responses
+    sftp_pipeline_depth = 256
+    # Files bigger than this will be downloaded in several streams
+    parallel_threshold = 64 * 1024 * 1024
+
     def __repr__(self):
         orig = super(SSHClient, self).__repr__()
         return '{} [{}:{}]'.format(orig, self.host, self.port)
@@ -111,7 +346,8 @@ class SSHClient(object):
             self.ssh.sudo_mode = False
 
     def __init__(self, host, port=22, username=None, password=None,
-                 private_keys=None, proxy_commands=(), timeout=120):
+                 private_keys=None, proxy_commands=(), proxy_sockets=(),
+                 timeout=120, pool=None, on_connect_error=None):
         self.host = str(host)
         self.port = int(port)
         self.username = username
@@ -124,9 +360,21 @@ class SSHClient(object):
         self.sudo = self.get_sudo(self)
         self.timeout = timeout
         self.proxy_commands = proxy_commands
+        self.proxy_sockets = proxy_sockets
+        self.pool = pool
+        # Called with exception, if connect on context enter is failed
+        self.on_connect_error = on_connect_error
+        # Guards reconnect of client shared between threads
+        self.connect_lock = threading.Lock()
         self._ssh = None
         self._sftp_client = None
         self._proxy = None
+        self._pooled = None
+
+    @property
+    def pool_key(self):
+        return (self.host, self.port, self.username,
+                tuple(self.proxy_commands))
 
     def clear(self):
         if self._sftp_client is not None:
@@ -134,6 +382,14 @@ class SSHClient(object):
                 self._sftp_client.close()
             except Exception:
                 logger.exception("Could not close sftp connection")
+            self._sftp_client = None
+
+        if self._pooled is not None:
+            # Shared connection is closed by pool
+            self.pool.release(self._pooled)
+            self._pooled = None
+            self._ssh = None
+            return
 
         if self._ssh is not None:
             try:
@@ -153,8 +409,10 @@ class SSHClient(object):
     def __enter__(self):
         try:
             self.reconnect()
-        except Exception:
+        except Exception as e:
             self.clear()
+            if self.on_connect_error is not None:
+                self.on_connect_error(e)
             raise
         return self
 
@@ -187,10 +445,30 @@ class SSHClient(object):
     @retry(count=3, delay=3, pass_counter='counter')
     def reconnect(self, counter):
         self.clear()
+        if self.pool is not None:
+            self._pooled = self.pool.acquire(
+                self.pool_key, lambda: self._open_pooled(counter))
+            self._ssh = self._pooled.ssh
+            return
+        self._open(counter)
+
+    def _open_pooled(self, counter):
+        self._open(counter)
+        # proxy will be closed with pooled transport
+        ssh, self._ssh, self._proxy = self._ssh, None, None
+        return ssh
+
+    def _open(self, counter):
         self._ssh = paramiko.SSHClient()
         self._ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        if self.proxy_sockets:
+            proxy_socket = self.proxy_sockets[
+                counter % len(self.proxy_sockets)]
+            logger.debug('Proxy socket for ssh: {0}'.format(proxy_socket))
+            self._proxy = proxy_socket()
+            self._proxy.settimeout(self.timeout)
         proxies_count = len(self.proxy_commands)
-        if proxies_count > 0:
+        if proxies_count > 0 and self._proxy is None:
             proxy_command = self.proxy_commands[counter % proxies_count]
             logger.debug('Proxy command for ssh: "{0}"'.format(proxy_command))
             self._proxy = paramiko.ProxyCommand(proxy_command)
@@ -213,40 +491,45 @@ class SSHClient(object):
 
     @classmethod
     def execute_together(cls, remotes, command):
-        futures = {}
-        errors = {}
-        for remote in remotes:
-            cmd = "%s\n" % command
-            if remote.sudo_mode:
-                cmd = 'sudo -S bash -c "%s"' % cmd.replace('"', '\\"')
-            chan = remote._ssh.get_transport().open_session()
-            chan.exec_command(cmd)
-            futures[remote] = chan
-        for remote, chan in futures.items():
-            ret = chan.recv_exit_status()
-            if ret != 0:
-                errors[remote.host] = ret
+        executor = ParallelExecutor(max_workers=max(len(remotes), 1))
+        results = executor.execute(remotes, command)
+        errors = {host: result['exit_code']
+                  for host, result in results.items() if not result.is_ok}
         if errors:
             raise CalledProcessError(command, errors)
 
-    def execute(self, command, verbose=True, merge_stderr=False):
+    def execute(self, command, verbose=True, merge_stderr=False,
+                timeout=None):
+        """Execute command and return CommandResult
+
+        :param timeout: seconds to wait for command to finish. If None -
+            wait forever, otherwise raise CommandTimeoutExpired
+        """
         chan, stdin, stdout, stderr = self.execute_async(
             command, merge_stderr=merge_stderr)
 
-        stdout_buf = ''
-        stderr_buf = ''
+        stdout_chunks = []
+        stderr_chunks = []
+        deadline = None if timeout is None else time.time() + timeout
+        select_timeout = self.select_timeout
 
         while not chan.closed or chan.recv_ready() or chan.recv_stderr_ready():
-            select.select([chan], [], [chan], 60)
+            if deadline is not None:
+                select_timeout = min(self.select_timeout,
+                                     deadline - time.time())
+                if select_timeout <= 0:
+                    chan.close()
+                    raise CommandTimeoutExpired(command, timeout)
+            select.select([chan], [], [chan], select_timeout)
 
             if chan.recv_ready():
-                stdout_buf += chan.recv(1024)
+                stdout_chunks.append(chan.recv(self.recv_size))
             if chan.recv_stderr_ready():
-                stderr_buf += chan.recv_stderr(1024)
+                stderr_chunks.append(chan.recv_stderr(self.recv_size))
 
         result = CommandResult({
-            'stdout': stdout_buf.splitlines(True),
-            'stderr': stderr_buf.splitlines(True),
+            'stdout': b''.join(stdout_chunks).splitlines(True),
+            'stderr': b''.join(stderr_chunks).splitlines(True),
             'exit_code': chan.recv_exit_status()
         })
         stdin.close()
@@ -262,6 +545,38 @@ class SSHClient(object):
                 logger.debug(u'Stderr:\n{0}'.format(result.stderr_string))
         return result
 
+    def iter_lines(self, chan):
+        """Yield decoded lines of channel output as they arrive
+
+        Only incomplete last line is kept in memory.
+        """
+        tail = b''
+        while True:
+            data = chan.recv(self.recv_size)
+            if not data:
+                break
+            lines = (tail + data).split(b'\n')
+            tail = lines.pop()
+            for line in lines:
+                yield (line + b'\n').decode('utf-8', 'replace')
+        if tail:
+            yield tail.decode('utf-8', 'replace')
+
+    def execute_stream(self, command, merge_stderr=True):
+        """Execute command and yield output lines as they arrive
+
+        Useful for long running commands with big output (tcpdump, ping,
+        journalctl) to process it without holding it all in memory.
+        """
+        chan, stdin, stdout, stderr = self.execute_async(
+            command, merge_stderr=merge_stderr)
+        try:
+            for line in self.iter_lines(chan):
+                yield line
+        finally:
+            stdin.close()
+            chan.close()
+
     def execute_async(self, command, merge_stderr=False):
         logger.debug("Executing command: '%s'" % command.rstrip())
         chan = self._ssh.get_transport().open_session(timeout=self.timeout)
@@ -293,7 +608,17 @@ class SSHClient(object):
     def open(self, path, mode='r'):
         return self._sftp.open(path, mode)
 
-    def upload(self, source, target):
+    def upload(self, source, target, bulk=True, compression=None,
+               skip_unchanged=False):
+        """Upload file or directory to remote host
+
+        :param bulk: upload directory as single tar stream through one
+            exec channel instead of per-file sftp transfers
+        :param compression: None, 'gz' or 'bz2' - tar stream compression
+            for bulk mode
+        :param skip_unchanged: compare local and remote files checksums and
+            upload changed files only (bulk mode only)
+        """
         logger.debug("Copying '%s' -> '%s'", source, target)
 
         if self.isdir(target):
@@ -301,7 +626,12 @@ class SSHClient(object):
 
         source = os.path.expanduser(source)
         if not os.path.isdir(source):
-            self._sftp.put(source, target)
+            self._upload_file(source, target)
+            return
+
+        if bulk:
+            self._upload_tar(source, target, compression=compression,
+                             skip_unchanged=skip_unchanged)
             return
 
         for rootdir, subdirs, files in os.walk(source):
@@ -319,7 +649,170 @@ class SSHClient(object):
                     self._sftp.unlink(remote_path)
                 self._sftp.put(local_path, remote_path)
 
-    def download(self, destination, target):
+    def _remote_checksums(self, path):
+        """Return dict with md5 sums of all files under remote path
+
+        Keys are file paths relative to `path`.
+        """
+        result = self.execute(
+            'cd {0} && find . -type f -exec md5sum {{}} +'.format(path),
+            verbose=False)
+        checksums = {}
+        if not result.is_ok:
+            return checksums
+        for line in result['stdout']:
+            line = line.decode('utf-8').rstrip('\n')
+            checksum, _, name = line.partition('  ')
+            checksums[posixpath.normpath(name)] = checksum
+        return checksums
+
+    def _upload_tar(self, source, target, compression=None,
+                    skip_unchanged=False):
+        """Stream local directory as tar archive to remote `tar -x`"""
+        flags = {None: '', 'gz': 'z', 'bz2': 'j'}
+        if compression not in flags:
+            raise ValueError(
+                'Unsupported compression {0}'.format(compression))
+
+        files = []
+        dirs = []
+        for rootdir, subdirs, filenames in os.walk(source):
+            dirs.append(os.path.relpath(rootdir, source))
+            files += [os.path.relpath(os.path.join(rootdir, x), source)
+                      for x in filenames]
+
+        if skip_unchanged:
+            remote_checksums = self._remote_checksums(target)
+
+            def is_changed(name):
+                checksum = hashlib.md5()
+                with open(os.path.join(source, name), 'rb') as f:
+                    for chunk in iter(lambda: f.read(self.recv_size), b''):
+                        checksum.update(chunk)
+                return remote_checksums.get(
+                    name.replace(os.sep, '/')) != checksum.hexdigest()
+
+            files = [x for x in files if is_changed(x)]
+            if not files:
+                logger.debug("All files in '%s' are up to date", target)
+                return
+
+        logger.debug('Streaming %s files to %s as tar', len(files), target)
+        # files should be owned by remote user like after sftp upload, not
+        # by uid of local user
+        cmd = 'mkdir -p {0} && tar --no-same-owner -x{1}f - -C {0}'.format(
+            target, flags[compression])
+        chan = self._ssh.get_transport().open_session(timeout=self.timeout)
+        chan.exec_command(cmd)
+        stream = chan.makefile('wb')
+        mode = 'w|{0}'.format(compression or '')
+        with tarfile.open(fileobj=stream, mode=mode) as tar:
+            for name in dirs:
+                tar.add(os.path.join(source, name), arcname=name,
+                        recursive=False)
+            for name in files:
+                tar.add(os.path.join(source, name), arcname=name)
+        stream.flush()
+        chan.shutdown_write()
+        exit_code = chan.recv_exit_status()
+        stderr = chan.makefile_stderr('rb').read()
+        chan.close()
+        if exit_code != 0:
+            raise CalledProcessError(cmd, exit_code, stderr)
+
+    def _open_transfer_sftp(self):
+        """Open sftp client with large window for bulk transfers"""
+        return paramiko.SFTPClient.from_transport(
+            self._ssh.get_transport(), window_size=self.sftp_window_size)
+
+    def _report_transfer(self, direction, source, target, size, seconds):
+        stats = TransferStats(direction=direction, host=self.host,
+                              source=source, target=target, size=size,
+                              seconds=seconds)
+        logger.info('{0.direction} {0.source} -> {0.target}: {1:.1f} MiB in '
+                    '{0.seconds:.1f}s ({2:.2f} MiB/s)'.format(
+                        stats, size / 2.0 ** 20, stats.speed / 2.0 ** 20))
+        for hook in transfer_hooks:
+            hook(stats)
+
+    def _transfer_with_resume(self, transfer, retries):
+        """Call `transfer` and retry it after reconnect on connection errors
+
+        `transfer` should continue from already transferred offset.
+        """
+        for attempt in range(retries + 1):
+            try:
+                return transfer()
+            except (IOError, EOFError, paramiko.SSHException) as e:
+                if attempt == retries:
+                    raise
+                logger.warning('Transfer interrupted: {0}. Reconnect and '
+                               'resume'.format(e))
+                self.reconnect()
+
+    def _upload_file(self, source, target, retries=3):
+        size = os.path.getsize(source)
+        # Target is truncated by first attempt, so next attempts may resume
+        # from remote file size
+        state = {'started': False}
+
+        def upload():
+            sftp = self._open_transfer_sftp()
+            try:
+                offset = 0
+                if state['started']:
+                    # Resume after reconnect
+                    offset = min(sftp.stat(target).st_size, size)
+                mode = 'r+b' if offset > 0 else 'wb'
+                with open(source, 'rb') as local_file:
+                    with sftp.open(target, mode) as remote_file:
+                        state['started'] = True
+                        remote_file.set_pipelined(True)
+                        local_file.seek(offset)
+                        remote_file.seek(offset)
+                        for chunk in iter(
+                                lambda: local_file.read(
+                                    self.sftp_request_size), b''):
+                            remote_file.write(chunk)
+            finally:
+                sftp.close()
+
+        start = time.time()
+        self._transfer_with_resume(upload, retries)
+        self._report_transfer('upload', source, target, size,
+                              time.time() - start)
+
+    def _download_segment(self, source, part, start, end):
+        """Append remote file bytes range [start, end) to local part file
+
+        Return count of transferred bytes
+        """
+        with open(part, 'ab') as local_file:
+            offset = start + local_file.tell()
+            if offset >= end:
+                return 0
+            step = self.sftp_request_size
+            depth = self.sftp_pipeline_depth
+            chunks = [(x, min(step, end - x))
+                      for x in range(offset, end, step)]
+            sftp = self._open_transfer_sftp()
+            try:
+                with sftp.open(source, 'rb') as remote_file:
+                    for i in range(0, len(chunks), depth):
+                        for data in remote_file.readv(chunks[i:i + depth]):
+                            local_file.write(data)
+            finally:
+                sftp.close()
+        return end - offset
+
+    def download(self, destination, target, streams=None, retries=3):
+        """Download remote file
+
+        :param streams: count of parallel ranged streams. If None - file
+            bigger than `parallel_threshold` will be downloaded in 4 streams
+        :param retries: count of reconnects to resume interrupted download
+        :return: True if target file exists after download
+        """
         logger.debug(
             "Copying '%s' -> '%s' from remote to local host",
             destination, target
@@ -328,17 +821,52 @@ class SSHClient(object):
         if os.path.isdir(target):
             target = posixpath.join(target, os.path.basename(destination))
 
-        if not self.isdir(destination):
-            if self.exists(destination):
-                self._sftp.get(destination, target)
-            else:
-                logger.debug(
-                    "Can't download %s because it doesn't exist", destination
-                )
-        else:
+        try:
+            attrs = self._sftp.stat(destination)
+        except IOError:
+            logger.debug(
+                "Can't download %s because it doesn't exist", destination
+            )
+            return os.path.exists(target)
+        if stat.S_ISDIR(attrs.st_mode):
             logger.debug(
                 "Can't download %s because it is a directory", destination
             )
+            return os.path.exists(target)
+
+        size = attrs.st_size
+        if streams is None:
+            streams = 4 if size >= self.parallel_threshold else 1
+        segment_size = max(-(-size // streams), 1)
+        segments = [(start, min(start + segment_size, size))
+                    for start in range(0, size, segment_size)] or [(0, 0)]
+        parts = ['{0}.part{1}'.format(target, i)
+                 for i in range(len(segments))]
+        for part in parts:
+            if os.path.exists(part):
+                os.remove(part)
+        executor = ParallelExecutor(max_workers=len(segments))
+
+        def download():
+            return sum(executor.map(
+                lambda args: self._download_segment(destination, *args),
+                [(part, start, end)
+                 for part, (start, end) in zip(parts, segments)]))
+
+        start = time.time()
+        self._transfer_with_resume(download, retries)
+        if len(parts) == 1:
+            if os.path.exists(target):
+                os.remove(target)
+            os.rename(parts[0], target)
+        else:
+            with open(target, 'wb') as f:
+                for part in parts:
+                    with open(part, 'rb') as part_file:
+                        shutil.copyfileobj(part_file, f, self.recv_size)
+                    os.remove(part)
+        self._report_transfer('download', destination, target, size,
+                              time.time() - start)
         return os.path.exists(target)
 
     def exists(self, path):
@@ -363,5 +891,160 @@ class SSHClient(object):
             return False
 
 
+class NetnsProxy(object):
+    """Socket factory for ssh connections to host in network namespace
+
+    Each call opens exec channel with `nc` running in the namespace on
+    the node, which hosts it. Channels are opened on the node connection
+    from the pool, so connect to VM requires neither local ProxyCommand
+    process nor a new handshake with the node.
+
+    :param remote: SSHClient to the node with namespace
+    :param namespace: network namespace name (like qdhcp-<net_id>)
+    :param host: host to connect to in namespace
+    :param port: port to connect to
+    """
+
+    def __init__(self, remote, namespace, host, port=22):
+        self.remote = remote
+        self.namespace = namespace
+        self.host = host
+        self.port = port
+
+    def __repr__(self):
+        return '<NetnsProxy {0.remote.host}:{0.namespace} -> ' \
+            '{0.host}:{0.port}>'.format(self)
+
+    def _get_ssh(self, broken=None):
+        """Return connection to jump host, replace broken one with new
+
+        Jump host client is shared by proxies of many instances, which may
+        be connected concurrently, so connection is replaced under client
+        lock and only once for each broken connection.
+
+        :param broken: paramiko.SSHClient, which failed to open channel
+        """
+        with self.remote.connect_lock:
+            ssh = self.remote._ssh
+            if ssh is not None and ssh is not broken:
+                return ssh
+            if broken is not None:
+                # dead connection will be evicted from pool on reconnect
+                broken.close()
+            self.remote.reconnect()
+            return self.remote._ssh
+
+    def _open_channel(self, ssh):
+        transport = ssh.get_transport()
+        chan = transport.open_session(timeout=self.remote.timeout)
+        chan.exec_command('ip netns exec {0} nc {1} {2}'.format(
+            self.namespace, self.host, self.port))
+        return chan
+
+    def __call__(self):
+        ssh = self._get_ssh()
+        try:
+            return self._open_channel(ssh)
+        except paramiko.ChannelException:
+            # channel is refused by server, but connection is alive and
+            # may be used by other threads
+            raise
+        except Exception as e:
+            logger.debug('Connection to jump host {0} is broken: {1}'.format(
+                self.remote.host, e))
+        # Try again with the new connection
+        return self._open_channel(self._get_ssh(broken=ssh))
+
+
+class ParallelExecutor(object):
+    """Run commands or functions on many remotes concurrently
+
+    :param max_workers: maximum count of concurrently running tasks
+    :param timeout: per-host command timeout in seconds
+    :param fail_fast: if True - don't start new tasks after first failure
+        and raise it, otherwise run all tasks and collect all results
+    """
+
+    def __init__(self, max_workers=10, timeout=None, fail_fast=False):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.fail_fast = fail_fast
+
+    def map(self, func, items):
+        """Call `func` for each item concurrently
+
+        First raised exception is re-raised after all started tasks are
+        finished.
+
+        :return: list of `func` results in `items` order
+        """
+        items = list(items)
+        results = [None] * len(items)
+        errors = []
+        stop = threading.Event()
+
+        def run(args):
+            i, item = args
+            if stop.is_set():
+                return
+            try:
+                results[i] = func(item)
+            except Exception:
+                errors.append(sys.exc_info())
+                if self.fail_fast:
+                    stop.set()
+
+        if not items:
+            return results
+        pool = ThreadPool(min(self.max_workers, len(items)))
+        try:
+            pool.map(run, enumerate(items))
+        finally:
+            pool.close()
+            pool.join()
+        if errors:
+            six.reraise(*errors[0])
+        return results
+
+    def execute(self, remotes, command, verbose=False):
+        """Execute command on remotes concurrently
+
+        Remotes without established connection are connected for the
+        command run only. Errors (like connection fails or timeouts) are
+        stored to `error` key of result in collect-all mode.
+
+        :param remotes: list of SSHClient instances
+        :return: dict with remote host as keys and CommandResult as values
+            with additional `host` and `duration` keys
+        """
+
+        def run(remote):
+            start = time.time()
+            try:
+                if remote._ssh is None:
+                    with remote:
+                        result = remote.execute(command, verbose=verbose,
+                                                timeout=self.timeout)
+                else:
+                    result = remote.execute(command, verbose=verbose,
+                                            timeout=self.timeout)
+            except Exception as e:
+                if self.fail_fast:
+                    raise
+                logger.warning('{0} failed on {1}: {2}'.format(
+                    command, remote.host, e))
+                result = CommandResult({'stdout': [], 'stderr': [],
+                                        'exit_code': None, 'error': e})
+            result['host'] = remote.host
+            result['duration'] = time.time() - start
+            if self.fail_fast and not result.is_ok:
+                raise CalledProcessError(command, result['exit_code'],
+                                         result['stdout'] + result['stderr'])
+            return result
+
+        results = self.map(run, remotes)
+        return {result['host']: result for result in results}
+
+
 def ssh(*args, **kwargs):
     return SSHClient(*args, **kwargs)
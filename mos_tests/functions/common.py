@@ -12,31 +12,46 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-import inspect
+from collections import defaultdict
+from collections import namedtuple
+from datetime import datetime
 import logging
 import os
+import random
 import socket
+import sys
 from tempfile import NamedTemporaryFile
+import threading
 from time import sleep
 from time import time
-import urllib2
 
 import uuid
 from waiting import TimeoutExpired
 from waiting import wait as base_wait
 import yaml
 
+from mos_tests.functions import file_cache
+
 
 logger = logging.getLogger(__name__)
 
 
+def _find_stack(heat, stack_name):
+    try:
+        return heat.stacks.get(stack_name)
+    except Exception as e:
+        if is_not_found(e):
+            return None
+        raise
+
+
 def is_stack_exists(stack_name, heat):
     """Check the presence of stack_name in stacks list
         :param stack_name: Name of stack
         :param heat: Heat API client connection point
         :return True or False
     """
-    return stack_name in [s.stack_name for s in heat.stacks.list()]
+    return _find_stack(heat, stack_name) is not None
 
 
 def get_stack_id(heat_client, stack_name):
@@ -45,11 +60,133 @@ def get_stack_id(heat_client, stack_name):
         :param stack_name: Name of stack
         :return Stack uid
     """
-    if is_stack_exists(stack_name, heat_client):
-        return heat_client.stacks.list(filter={'name': stack_name}).id
+    stack = _find_stack(heat_client, stack_name)
+    if stack is not None:
+        return stack.id
     raise Exception("ERROR: Stack {} is not defined".format(stack_name))
 
 
+class StackActionFailed(Exception):
+    pass
+
+
+def parse_event_time(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%dT%H:%M:%SZ')
+    except (TypeError, ValueError):
+        return None
+
+
+class StackEventsWaiter(object):
+    """Wait for stack action finish by tailing stack events
+
+    Only events, which are newer than last seen, are requested on each tick.
+    First failed resource is reported immediately.
+
+    :param heat_client: Heat API client connection point
+    :param stack_id: stack name or UID
+    """
+
+    def __init__(self, heat_client, stack_id, min_interval=1,
+                 max_interval=10):
+        self.heat = heat_client
+        stack = heat_client.stacks.get(stack_id)
+        self.stack_name = stack.stack_name
+        # full identifier avoids stack lookup on each events request
+        self.identifier = '{0.stack_name}/{0.id}'.format(stack)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.events = []
+        self.marker = None
+        # status from the last stack (not resource) event
+        self.stack_status = None
+        # first failed resource event in current stack action
+        self.failed_event = None
+
+    def poll(self):
+        """Request and process new events
+
+        :return: list of new events
+        """
+        kwargs = {'sort_dir': 'asc'}
+        if self.marker is not None:
+            kwargs['marker'] = self.marker
+        events = self.heat.events.list(self.identifier, **kwargs)
+        for event in events:
+            self.events.append(event)
+            self.marker = event.id
+            status = event.resource_status
+            if event.resource_name == self.stack_name:
+                self.stack_status = status
+                if status.endswith('_IN_PROGRESS'):
+                    self.failed_event = None
+            elif status.endswith('_FAILED') and self.failed_event is None:
+                self.failed_event = event
+        return events
+
+    def skip_existing(self):
+        """Ignore already happened events (call before triggering action)"""
+        self.poll()
+        self.events = []
+        self.stack_status = None
+        self.failed_event = None
+
+    def timeline(self):
+        """Return text lines with statuses changes of each resource"""
+        resources = defaultdict(list)
+        for event in self.events:
+            resources[event.resource_name].append(event)
+        lines = []
+        for name, events in sorted(resources.items()):
+            steps = ' -> '.join('{0.resource_status} {0.event_time}'.format(x)
+                                for x in events)
+            start = parse_event_time(events[0].event_time)
+            end = parse_event_time(events[-1].event_time)
+            if start is not None and end is not None:
+                steps += ' ({}s)'.format(int((end - start).total_seconds()))
+            lines.append('{}: {}'.format(name, steps))
+        return lines
+
+    def wait(self, action, timeout_seconds=600, fail_fast=True):
+        """Wait for stack action to be finished
+
+        :param action: stack action, like CREATE, UPDATE
+        :param fail_fast: raise StackActionFailed on first failed resource
+            or failed stack action
+        :return: final stack status
+        """
+        finished = ('{}_COMPLETE'.format(action), '{}_FAILED'.format(action))
+        waiting_for = 'stack {} {} to be finished'.format(self.stack_name,
+                                                          action)
+        logger.info('waiting for {}'.format(waiting_for))
+        deadline = time() + timeout_seconds
+        interval = self.min_interval
+        while True:
+            new_events = self.poll()
+            if self.stack_status in finished:
+                break
+            if fail_fast and self.failed_event is not None:
+                break
+            if time() > deadline:
+                raise TimeoutExpired(timeout_seconds, waiting_for)
+            if new_events:
+                interval = self.min_interval
+            else:
+                interval = min(interval * 1.5, self.max_interval)
+            sleep(interval)
+        logger.debug('Stack {} events timeline:\n{}'.format(
+            self.stack_name, '\n'.join(self.timeline())))
+        if fail_fast and self.failed_event is not None:
+            event = self.failed_event
+            raise StackActionFailed(
+                'Stack {0} resource {1.resource_name} is {1.resource_status}: '
+                '{1.resource_status_reason}'.format(self.stack_name, event))
+        if fail_fast and self.stack_status.endswith('_FAILED'):
+            raise StackActionFailed('Stack {} is {}'.format(self.stack_name,
+                                                            self.stack_status))
+        return self.stack_status
+
+
 def check_stack_status(stack_name, heat, status, timeout=60):
     """Check stack status
         :param stack_name: Name of stack
@@ -59,17 +196,20 @@ def check_stack_status(stack_name, heat, status, timeout=60):
         :return True if stack status is equals to expected status
         False otherwise
     """
-    if is_stack_exists(stack_name, heat):
-        start_time = time()
-        stack_status = [s.stack_status for s in heat.stacks.list()
-                        if s.stack_name == stack_name][0]
-        while 'IN_PROGRESS' in stack_status \
-                and time() < start_time + 60 * timeout:
-            sleep(1)
-            stack_status = [s.stack_status for s in heat.stacks.list()
-                            if s.stack_name == stack_name][0]
-        return stack_status == status
-    return False
+    stack = _find_stack(heat, stack_name)
+    if stack is None:
+        return False
+    stack_status = stack.stack_status
+    if 'IN_PROGRESS' in stack_status:
+        waiter = StackEventsWaiter(heat, stack.id)
+        try:
+            action = stack_status.rsplit('_IN_PROGRESS', 1)[0]
+            stack_status = waiter.wait(action,
+                                       timeout_seconds=60 * timeout,
+                                       fail_fast=False)
+        except TimeoutExpired:
+            return False
+    return stack_status == status
 
 
 def create_stack(heat_client, stack_name, template, parameters={}, timeout=20,
@@ -92,16 +232,8 @@ def create_stack(heat_client, stack_name, template, parameters={}, timeout=20,
         parameters=parameters,
         timeout_mins=timeout)
     uid = stack['stack']['id']
-
-    def is_stack_created():
-        stack = heat_client.stacks.get(uid)
-        if stack.stack_status == 'CREATE_FAILED':
-            raise Exception(stack.stack_status_reason)
-        elif stack.stack_status == 'CREATE_COMPLETE':
-            return True
-
-    wait(is_stack_created, timeout_seconds=timeout * 60, sleep_seconds=10,
-        waiting_for='stack {} status to be CREATE_COMPLETE'.format(stack_name))
+    StackEventsWaiter(heat_client, uid).wait('CREATE',
+                                             timeout_seconds=timeout * 60)
     return uid
 
 
@@ -110,10 +242,11 @@ def delete_stack(heat_client, uid):
         :param heat_client: Heat API client connection point
         :param uid:         UID of stack
     """
-    if uid in [s.id for s in heat_client.stacks.list()]:
+    watcher = ResourceWatcher(heat_client.stacks, status_attr='stack_status')
+    if watcher.get_status(uid) not in (watcher.DELETED, 'DELETE_COMPLETE'):
         heat_client.stacks.delete(uid)
-        while uid in [s.id for s in heat_client.stacks.list()]:
-            sleep(1)
+        watcher.wait([uid], [watcher.DELETED, 'DELETE_COMPLETE'],
+                     stop_statuses=['DELETE_FAILED'])
 
 
 def check_stack_status_complete(heat_client, uid, action, timeout=10):
@@ -126,13 +259,14 @@ def check_stack_status_complete(heat_client, uid, action, timeout=10):
         :return uid: UID of created stack
     """
     stack = heat_client.stacks.get(stack_id=uid).to_dict()
-    end_time = time() + 60 * timeout
-    while stack['stack_status'] == '{}_IN_PROGRESS'.format(action):
-        stack = heat_client.stacks.get(stack_id=uid).to_dict()
-        if time() > end_time:
-            break
-        else:
-            sleep(1)
+    if stack['stack_status'] == '{}_IN_PROGRESS'.format(action):
+        waiter = StackEventsWaiter(heat_client, uid)
+        try:
+            stack['stack_status'] = waiter.wait(action,
+                                                timeout_seconds=60 * timeout,
+                                                fail_fast=False)
+        except TimeoutExpired:
+            stack = heat_client.stacks.get(stack_id=uid).to_dict()
     if stack['stack_status'] != '{}_COMPLETE'.format(action):
         raise Exception("ERROR: Stack {} is not in '{}_COMPLETE' "
                         "state:\n".format(stack, action))
@@ -162,9 +296,11 @@ def update_stack(heat_client, uid, template_file, parameters={}):
         :param parameters:    Parameters from template
         :return: -
     """
+    waiter = StackEventsWaiter(heat_client, uid)
+    waiter.skip_existing()
     heat_client.stacks.update(stack_id=uid, template=template_file,
                               parameters=parameters)
-    check_stack_status_complete(heat_client, uid, 'UPDATE')
+    waiter.wait('UPDATE', timeout_seconds=10 * 60)
 
 
 def get_resource_id(heat_client, uid):
@@ -214,12 +350,11 @@ def update_template_file(template_file, type_of_changes, **kwargs):
         yaml_file.write(yaml.dump(data, default_flow_style=False))
 
 
-def download_image(image_link_file, where_to_put='/tmp/'):
-    """This function will download image from internet and write it
-        if image is not already present on node.
+def download_image(image_link_file):
+    """This function will download image from internet to files cache
+        if image is not already cached.
         :param image_link_file: Location of file with a link
-        :param where_to_put:    Path to output folder on node
-        :return: full path to downloaded image. Default: '/tmp/blablablb.bla'
+        :return: full path to downloaded image
     """
     # Get URL from file
     try:
@@ -229,39 +364,7 @@ def download_image(image_link_file, where_to_put='/tmp/'):
         raise Exception("Can not find or read from file on node:"
                         "\n\t{}".format(image_link_file))
 
-    # Get image name from URL. Like: 'fedora-heat-test-image.qcow2'
-    image_name_from_url = image_url.rsplit('/', 1)[-1]
-
-    # Prepare full path on node. Like: '/tmp/fedora-heat-test-image.qcow2'
-    image_path_on_node = where_to_put + image_name_from_url
-
-    # Check if image already exists on node with path above.
-    # If present - return full path to it. If NOT -> download.
-    if os.path.isfile(image_path_on_node):
-        return image_path_on_node
-    else:
-        # Open URL
-        try:
-            response = urllib2.urlopen(image_url)
-        except urllib2.HTTPError as e:
-            raise Exception('Can not get file from URL. HTTPError = {}.'
-                            '\n\tURL = "{}"'.format(str(e.code), image_url))
-        except urllib2.URLError as e:
-            raise Exception('Can not get file from URL. URLError = {}.'
-                            '\n\tURL = "{}"'.format(str(e.reason), image_url))
-        except Exception:
-            raise Exception("Can not get file from URL:"
-                            "\n\t{}".format(image_url))
-
-        # Write image to file. With Chunk to avoid memory errors.
-        CHUNK = 16 * 1024
-        with open(image_path_on_node, 'wb') as f:
-            while True:
-                chunk = response.read(CHUNK)
-                if not chunk:
-                    break
-                f.write(chunk)
-        return image_path_on_node
+    return file_cache.get_file_path(image_url)
 
 
 # Instance functions
@@ -305,6 +408,207 @@ def check_volume_snapshot(cinder_client, uid):
     return uid in [s for s in cinder_client.volume_snapshots.list()]
 
 
+class ServerFuture(object):
+    """Result of server status watching by ServersPoller"""
+
+    def __init__(self, server_id, statuses):
+        self.server_id = server_id
+        self.statuses = statuses
+        self.server = None
+        self._event = threading.Event()
+
+    def done(self):
+        return self._event.is_set()
+
+    def set_result(self, server):
+        self.server = server
+        self._event.set()
+
+    def wait(self, timeout=None):
+        return self._event.wait(timeout)
+
+
+class ServersPoller(object):
+    """Watch statuses of many servers with one servers list request per tick
+
+    Only servers changed since previous tick are requested (with
+    `changes-since` filter). Poll interval grows while nothing changes and
+    is reset on any watched server status change.
+
+    :param nova_client: Nova API client connection point
+    :param min_interval: first and minimal interval between ticks in seconds
+    :param max_interval: maximal interval between ticks in seconds
+    :param backoff: interval multiplier for ticks without changes
+    """
+
+    def __init__(self, nova_client, min_interval=1, max_interval=10,
+                 backoff=1.5):
+        self.nova = nova_client
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.interval = min_interval
+        self._futures = {}
+        self._new_futures = False
+        # `updated` of the latest seen server, in nova clock
+        self._changes_since = None
+        self._next_poll = 0
+        self._lock = threading.Lock()
+
+    def watch(self, server_id, statuses=('ACTIVE', 'ERROR')):
+        """Start watching server
+
+        :param statuses: statuses to resolve future on
+        :return: ServerFuture
+        """
+        future = ServerFuture(server_id, statuses)
+        with self._lock:
+            self._futures.setdefault(server_id, []).append(future)
+            self._new_futures = True
+            self.interval = self.min_interval
+            self._next_poll = 0
+        return future
+
+    def poll(self):
+        """Make single list request and resolve futures"""
+        search_opts = {}
+        # servers, added to watch, may be updated before last seen change
+        if self._changes_since is not None and not self._new_futures:
+            search_opts['changes-since'] = self._changes_since
+        self._new_futures = False
+        servers = self.nova.servers.list(search_opts=search_opts)
+        resolved = False
+        for server in servers:
+            updated = getattr(server, 'updated', None)
+            if updated and updated > (self._changes_since or ''):
+                self._changes_since = updated
+            for future in self._futures.get(server.id, [])[:]:
+                if server.status in future.statuses:
+                    future.set_result(server)
+                    self._futures[server.id].remove(future)
+                    resolved = True
+            if not self._futures.get(server.id, True):
+                del self._futures[server.id]
+        if resolved:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff,
+                                self.max_interval)
+        self._next_poll = time() + self.interval
+
+    def wait(self, futures, timeout_seconds=300, waiting_for=None):
+        """Wait for futures to be resolved
+
+        :return: list of servers for futures
+        """
+        waiting_for = waiting_for or '{} servers statuses'.format(
+            len(futures))
+        logger.info('waiting for {}'.format(waiting_for))
+        deadline = time() + timeout_seconds
+        pending = [x for x in futures if not x.done()]
+        while pending:
+            if time() > deadline:
+                raise TimeoutExpired(timeout_seconds, waiting_for)
+            with self._lock:
+                if time() >= self._next_poll:
+                    self.poll()
+                delay = max(self._next_poll - time(), 0)
+            pending = [x for x in pending if not x.done()]
+            if pending:
+                # other thread may resolve future earlier
+                pending[0].wait(min(delay, max(deadline - time(), 0)))
+        logger.info('waiting for {} ... done'.format(waiting_for))
+        return [x.server for x in futures]
+
+
+def is_not_found(error):
+    """Check that client exception means 404 Not Found"""
+    return 404 in (getattr(error, 'code', None),
+                   getattr(error, 'status_code', None))
+
+
+class ResourceWatcher(object):
+    """Watch statuses of OpenStack resources of same kind
+
+    Single resource is fetched by id (not found resource is considered as
+    deleted), many resources - with one list request per tick. Interval
+    between ticks grows exponentially with random jitter.
+
+    :param manager: client resources manager, like `nova_client.servers`
+    :param status_attr: name of resource status attribute
+    :param min_interval: first interval between ticks in seconds
+    :param max_interval: maximal interval between ticks in seconds
+    :param backoff: interval multiplier
+    :param jitter: max relative random deviation of interval
+    """
+
+    DELETED = 'DELETED'
+
+    def __init__(self, manager, status_attr='status', min_interval=0.5,
+                 max_interval=10, backoff=2, jitter=0.2):
+        self.manager = manager
+        self.status_attr = status_attr
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+
+    def get_status(self, uid):
+        """Return resource status or DELETED, if resource is not found"""
+        try:
+            resource = self.manager.get(uid)
+        except Exception as e:
+            if is_not_found(e):
+                return self.DELETED
+            raise
+        return getattr(resource, self.status_attr, None)
+
+    def get_statuses(self, uids):
+        """Return statuses of resources as dict with uids as keys"""
+        if len(uids) == 1:
+            return {uids[0]: self.get_status(uids[0])}
+        present = {x.id: getattr(x, self.status_attr, None)
+                   for x in self.manager.list()}
+        return {uid: present.get(uid, self.DELETED) for uid in uids}
+
+    def wait(self, uids, statuses, timeout_seconds=300,
+             stop_statuses=(DELETED,)):
+        """Wait for all resources to get one of `statuses`
+
+        Resource watching is stopped also if it get one of `stop_statuses`.
+
+        :return: dict with last known resources statuses
+        :raises TimeoutExpired: if some resources don't get any of
+            `statuses` or `stop_statuses` in time
+        """
+        uids = list(uids)
+        final = set(statuses) | set(stop_statuses)
+        event = '{} resources to get {} status'.format(len(uids),
+                                                       '/'.join(statuses))
+        deadline = time() + timeout_seconds
+        start = time()
+        interval = self.min_interval
+        result = {}
+        pending = uids
+        attempts = 0
+        while True:
+            attempts += 1
+            result.update(self.get_statuses(pending))
+            pending = [x for x in pending if result[x] not in final]
+            if not pending or time() > deadline:
+                break
+            delay = interval * random.uniform(1 - self.jitter,
+                                              1 + self.jitter)
+            sleep(max(min(delay, deadline - time()), 0))
+            interval = min(interval * self.backoff, self.max_interval)
+        success = all(result[x] in statuses for x in uids)
+        wait_timings.add(event, None, attempts, time() - start, success)
+        if pending:
+            raise TimeoutExpired(timeout_seconds, '{0} (last statuses: '
+                                 '{1})'.format(event, result))
+        return result
+
+
 def check_inst_status(nova_client, uid, status, timeout=5):
     """Check status of instance
         :param nova_client: Nova API client connection point
@@ -314,14 +618,13 @@ def check_inst_status(nova_client, uid, status, timeout=5):
         :return True or False
     """
     if is_instance_exists(nova_client, uid):
-        start_time = time()
-        inst_status = [s.status for s in nova_client.servers.list()
-                       if s.id == uid][0]
-        while inst_status != status and time() < start_time + 60 * timeout:
-            sleep(1)
-            inst_status = [s.status for s in nova_client.servers.list()
-                           if s.id == uid][0]
-        return inst_status == status
+        poller = ServersPoller(nova_client)
+        future = poller.watch(uid, statuses=(status, 'ERROR'))
+        try:
+            server, = poller.wait([future], timeout_seconds=60 * timeout)
+        except TimeoutExpired:
+            return False
+        return server.status == status
     return False
 
 
@@ -330,10 +633,10 @@ def delete_instance(nova_client, uid):
         :param nova_client: Nova API client connection point
         :param uid: UID of instance
     """
-    if is_instance_exists(nova_client, uid):
+    watcher = ResourceWatcher(nova_client.servers)
+    if watcher.get_status(uid) != watcher.DELETED:
         nova_client.servers.delete(uid)
-        while is_instance_exists(nova_client, uid):
-            sleep(1)
+        watcher.wait([uid], [watcher.DELETED])
 
 
 def create_instance(nova_client, inst_name, flavor_id, net_id,
@@ -447,11 +750,10 @@ def delete_volume(cinder_client, volume):
         :param cinder_client: Cinder API client connection point
         :param volume: volume
     """
-    if volume in cinder_client.volumes.list():
+    watcher = ResourceWatcher(cinder_client.volumes)
+    if watcher.get_status(volume.id) != watcher.DELETED:
         cinder_client.volumes.delete(volume)
-        volume_id = volume.id
-        while is_volume_exists(cinder_client, volume_id):
-            sleep(1)
+        watcher.wait([volume.id], [watcher.DELETED])
 
 
 def check_volume_status(cinder_client, uid, status, timeout=5):
@@ -462,16 +764,13 @@ def check_volume_status(cinder_client, uid, status, timeout=5):
         :param timeout: Timeout for check operation
         :return True or False
     """
-    if is_volume_exists(cinder_client, uid):
-        start_time = time()
-        inst_status = [s.status for s in cinder_client.volumes.list()
-                       if s.id == uid][0]
-        while inst_status != status and time() < start_time + 60 * timeout:
-            sleep(1)
-            inst_status = [s.status for s in cinder_client.volumes.list()
-                           if s.id == uid][0]
-        return inst_status == status
-    return False
+    watcher = ResourceWatcher(cinder_client.volumes)
+    try:
+        result = watcher.wait([uid], [status], timeout_seconds=60 * timeout,
+                              stop_statuses=[watcher.DELETED, 'error'])
+    except TimeoutExpired:
+        return False
+    return result[uid] == status
 
 
 # Flavor functions
@@ -502,12 +801,12 @@ def delete_flavor(nova_client, flavor_id):
         :param flavor_id: UID of the flavor to delete
         :return: Nothing
     """
-    for flavor in nova_client.flavors.list():
-        if flavor.id == flavor_id:
-            nova_client.flavors.delete(flavor)
-            break
-    while is_flavor_exists(nova_client, flavor_id):
-        sleep(1)
+    # Deleted flavor is still shown by id, so only list is checked
+    if is_flavor_exists(nova_client, flavor_id):
+        nova_client.flavors.delete(flavor_id)
+    wait(lambda: not is_flavor_exists(nova_client, flavor_id),
+         timeout_seconds=60, sleep_seconds=1,
+         waiting_for='flavor {} to be deleted'.format(flavor_id))
 
 
 # Images
@@ -528,9 +827,9 @@ def delete_image(glance_client, image_id):
         :param image_id: UID of the image to delete
         :return: Nothing
     """
+    watcher = ResourceWatcher(glance_client.images)
     glance_client.images.delete(image_id)
-    while is_image_exists(glance_client, image_id):
-        sleep(1)
+    watcher.wait([image_id], [watcher.DELETED, 'deleted'])
 
 
 # execution of system commands
@@ -566,16 +865,15 @@ def check_volume_snapshot_status(cinder_client, uid, status, timeout=5):
             :param timeout: Timeout for check operation
             :return True or False
     """
-    if check_volume_snapshot(cinder_client, uid):
-        start_time = time()
-        while time() < start_time + 60 * timeout:
-            sleep(1)
-            snapshot_status = [s.status
-                               for s in cinder_client.volume_snapshots.list()
-                               if s.id == uid.id][0]
-            if snapshot_status == status:
-                return True
-    return False
+    snapshot_id = getattr(uid, 'id', uid)
+    watcher = ResourceWatcher(cinder_client.volume_snapshots)
+    try:
+        result = watcher.wait([snapshot_id], [status],
+                              timeout_seconds=60 * timeout,
+                              stop_statuses=[watcher.DELETED, 'error'])
+    except TimeoutExpired:
+        return False
+    return result[snapshot_id] == status
 
 
 def delete_volume_snapshot(cinder_client, snapshot):
@@ -583,10 +881,10 @@ def delete_volume_snapshot(cinder_client, snapshot):
         :param cinder_client: Cinder API client connection point
         :param volume: volume snapshot
     """
-    if snapshot in cinder_client.volume_snapshots.list():
+    watcher = ResourceWatcher(cinder_client.volume_snapshots)
+    if watcher.get_status(snapshot.id) != watcher.DELETED:
         cinder_client.volume_snapshots.delete(snapshot)
-        while snapshot in cinder_client.volume_snapshots.list():
-            sleep(1)
+        watcher.wait([snapshot.id], [watcher.DELETED])
 
 
 # Keys
@@ -605,33 +903,82 @@ def delete_keys(nova_client, key_name):
         :param key_name: Name of the keypair to delete
         :return: Nothing
     """
-    for key in nova_client.keypairs.list():
-        if key.name == key_name:
-            nova_client.keypairs.delete(key)
-            break
-    while is_key_exists(nova_client, key_name):
-        sleep(1)
+    watcher = ResourceWatcher(nova_client.keypairs)
+    if watcher.get_status(key_name) != watcher.DELETED:
+        nova_client.keypairs.delete(key_name)
+        watcher.wait([key_name], [watcher.DELETED])
+
+
+WaitTiming = namedtuple('WaitTiming', ['test', 'event', 'called_from',
+                                       'attempts', 'duration', 'success'])
+
+
+class WaitTimings(object):
+    """Session registry of `wait` calls timings"""
+
+    def __init__(self):
+        self.records = []
+        # Test node id, set by test runner
+        self.current_test = None
+
+    def add(self, event, called_from, attempts, duration, success):
+        self.records.append(WaitTiming(self.current_test, event, called_from,
+                                       attempts, duration, success))
+
+    def slowest(self, count=10):
+        return sorted(self.records, key=lambda x: x.duration,
+                      reverse=True)[:count]
+
+    def report(self, count=10):
+        """Return text lines with the slowest waits"""
+        lines = []
+        for record in self.slowest(count):
+            lines.append(
+                '{0.duration:8.2f}s {0.attempts:5} attempts {status:7} '
+                '{0.test}: {0.event} ({0.called_from})'.format(
+                    record, status='done' if record.success else 'timeout'))
+        return lines
+
+
+wait_timings = WaitTimings()
 
 
 def wait(*args, **kwargs):
     __tracebackhide__ = True
 
-    frame = inspect.stack()[1]
-    called_from = '{0.f_globals[__name__]}:{2}'.format(*frame)
-    event = kwargs.get('waiting_for', args[0].__name__)
-    msg = '{called_from}: waiting for {event}'.format(event=event,
-                                                      called_from=called_from)
+    predicate = args[0]
+    event = kwargs.get('waiting_for') or predicate.__name__
     logger = logging.getLogger('waiting')
-
-    logger.info(msg)
-
+    called_from = None
+    if logger.isEnabledFor(logging.INFO):
+        frame = sys._getframe(1)
+        called_from = '{0}:{1}'.format(frame.f_globals.get('__name__'),
+                                       frame.f_lineno)
+        msg = '{called_from}: waiting for {event}'.format(
+            event=event, called_from=called_from)
+        logger.info(msg)
+
+    attempts = [0]
+
+    def counted_predicate(*p_args, **p_kwargs):
+        attempts[0] += 1
+        return predicate(*p_args, **p_kwargs)
+
+    kwargs.setdefault('waiting_for', event)
+    start = time()
+    success = False
     try:
-        result = base_wait(*args, **kwargs)
-        logger.info(msg + ' ... done')
+        result = base_wait(counted_predicate, *args[1:], **kwargs)
+        success = True
+        if called_from is not None:
+            logger.info(msg + ' ... done')
         return result
     except TimeoutExpired as e:
         # prevent shows traceback from waiting package
         raise e
+    finally:
+        wait_timings.add(event, called_from, attempts[0], time() - start,
+                         success)
 
 
 def gen_random_resource_name(prefix=None, reduce_by=None):
@@ -14,53 +14,511 @@
 
 from contextlib import contextmanager
 import email.utils
+import fcntl
+import hashlib
+import json
 import logging
 import os
+import shutil
+import tempfile
+import threading
+import time
 
 import requests
 
+from mos_tests.environment.ssh import ParallelExecutor
 from mos_tests import settings
 
 logger = logging.getLogger(__name__)
 
+CHUNK_SIZE = 65536
+MiB = 1024 ** 2
 
-@contextmanager
-def get_file(url, name=None):
-    with open(get_file_path(url, name), 'rb') as f:
-        yield f
+
+def url_key(url):
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+
+def parse_checksum(checksum):
+    """Split checksum like 'md5:d41d8cd9...' to algorithm and digest
+
+    sha256 is used if algorithm is omitted.
+    """
+    if ':' in checksum:
+        algorithm, digest = checksum.split(':', 1)
+    else:
+        algorithm, digest = 'sha256', checksum
+    return algorithm.lower(), digest.lower()
+
+
+class DownloadProgress(object):
+    """Thread-safe counter of downloaded bytes with periodic log
+
+    :param name: downloaded file name
+    :param total: expected size in bytes or None if unknown
+    :param done: already downloaded (by previous run) size in bytes
+    :param interval: seconds between log messages
+    """
+
+    def __init__(self, name, total=None, done=0, interval=10):
+        self.name = name
+        self.total = total
+        self.done = done
+        self.interval = interval
+        self.resumed = done
+        self.started = self.logged = time.time()
+        self.lock = threading.Lock()
+
+    @property
+    def speed(self):
+        """Average download speed of this run in MiB/s"""
+        duration = max(time.time() - self.started, 1e-3)
+        return (self.done - self.resumed) / float(MiB) / duration
+
+    def add(self, size):
+        with self.lock:
+            self.done += size
+            if time.time() - self.logged < self.interval:
+                return
+            self.logged = time.time()
+        self.log()
+
+    def log(self):
+        if self.total:
+            logger.info('Downloading {0.name}: {1:.1f}/{2:.1f} MiB '
+                        '({3:.0%}), {0.speed:.1f} MiB/s'.format(
+                            self, self.done / float(MiB),
+                            self.total / float(MiB),
+                            self.done / float(self.total)))
+        else:
+            logger.info('Downloading {0.name}: {1:.1f} MiB, '
+                        '{0.speed:.1f} MiB/s'.format(
+                            self, self.done / float(MiB)))
+
+    def log_finish(self):
+        logger.info('File {0.name} downloaded: {1:.1f} MiB in {2:.0f}s, '
+                    '{0.speed:.1f} MiB/s'.format(
+                        self, (self.done - self.resumed) / float(MiB),
+                        time.time() - self.started))
 
 
-def get_file_path(url, name=None):
-    if not os.path.exists(settings.TEST_IMAGE_PATH):
+class FileCache(object):
+    """Content-addressed cache of downloaded files
+
+    Files are stored as `objects/<content sha256>/<file name>`, urls
+    metadata (content hash, HTTP validators, last check time) - as
+    `urls/<url sha256>.json`. Every url is locked with fcntl lock during
+    check and download, so concurrent processes download file only once.
+    Files are replaced with atomic rename. Least recently used files are
+    evicted, when cache exceeds size budget.
+
+    Big files are downloaded with several HTTP Range requests in parallel,
+    if server supports it. Partially downloaded file and its segments state
+    are kept in `tmp` dir, so interrupted download is resumed on next call
+    (if file is not changed on server).
+
+    :param path: cache root dir
+    :param max_size: cache size budget in bytes
+    :param ttl: seconds to use cached file without checking for update
+    :param workers: count of parallel connections for big files
+    :param min_segment_size: minimal size of one Range request in bytes
+    :param retries: count of attempts to download each segment
+    """
+
+    # Seconds after last access, during which file is not evicted, so path
+    # returned to other process stays valid until file is opened
+    evict_grace_period = 60
+    # Seconds after last write, after which temporary and partially
+    # downloaded files are removed
+    tmp_max_age = 24 * 60 * 60
+
+    def __init__(self, path, max_size, ttl, workers=4,
+                 min_segment_size=16 * MiB, retries=3):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.workers = workers
+        self.min_segment_size = min_segment_size
+        self.retries = retries
+        for subdir in ('objects', 'urls', 'locks', 'tmp'):
+            path = os.path.join(self.path, subdir)
+            if not os.path.exists(path):
+                try:
+                    os.makedirs(path)
+                except OSError:
+                    # may be created by concurrent process
+                    if not os.path.isdir(path):
+                        raise
+
+    @contextmanager
+    def lock(self, name):
+        """Exclusive inter-process lock"""
+        with open(os.path.join(self.path, 'locks', name + '.lock'), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _meta_path(self, key):
+        return os.path.join(self.path, 'urls', key + '.json')
+
+    def _read_json(self, path):
         try:
-            os.makedirs(settings.TEST_IMAGE_PATH)
-        except Exception as e:
-            logger.warning("Can't make dir for files: {}".format(e))
+            with open(path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
             return None
 
-    file_path = os.path.join(settings.TEST_IMAGE_PATH,
-                             get_file_name(url))
-    headers = {}
-    if os.path.exists(file_path):
-        file_date = os.path.getmtime(file_path)
-        headers['If-Modified-Since'] = email.utils.formatdate(file_date)
-
-    response = requests.get(url, stream=True, headers=headers)
-
-    if response.status_code == 304:
-        logger.info("Image file is up to date")
-    elif response.status_code == 200:
-        logger.info("Start downloading image")
-        with open(file_path, 'wb') as f:
-            for chunk in response.iter_content(65536):
-                f.write(chunk)
-        logger.info("Image downloaded")
-    else:
-        logger.warning("Can't get fresh image. HTTP status code is "
-                       "{0.status_code}".format(response))
+    def _write_json(self, path, data):
+        fd, tmp_path = self.make_tmp_file()
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.rename(tmp_path, path)
+
+    def _object_path(self, meta):
+        return os.path.join(self.path, 'objects', meta['sha256'],
+                            meta['name'])
+
+    def get_file_path(self, url, name=None, checksum=None):
+        """Return path to cached file, download it if necessary
+
+        :param url: file url
+        :param name: file name, by default it is taken from url
+        :param checksum: expected checksum of downloaded file like
+            'md5:<hexdigest>' or '<sha256 hexdigest>'
+        """
+        key = url_key(url)
+        with self.lock(key):
+            meta = self._read_json(self._meta_path(key))
+            if meta is not None and not os.path.exists(
+                    self._object_path(meta)):
+                meta = None
+            if meta is None or time.time() - meta['checked_at'] > self.ttl:
+                meta = self._fetch(url, key, meta, name or get_file_name(url),
+                                   checksum)
+                self._write_json(self._meta_path(key), meta)
+            path = self._object_path(meta)
+            # mtime of object dir is used as last access time
+            os.utime(os.path.dirname(path), None)
+        self.evict(keep=path)
+        return path
+
+    def get_cached_path(self, key):
+        """Return path of file saved with `put` or None if it is absent
+
+        :param key: any string, which identifies file content
+        """
+        key = url_key(key)
+        with self.lock(key):
+            meta = self._read_json(self._meta_path(key))
+            if meta is None or not os.path.exists(self._object_path(meta)):
+                return None
+            path = self._object_path(meta)
+            os.utime(os.path.dirname(path), None)
+        return path
+
+    def put(self, key, tmp_path, name, hashers=None):
+        """Move file (e.g. made from other cached file) to cache
+
+        :param key: any string, which identifies file content
+        :param tmp_path: path of file in cache `tmp` dir
+        :param name: file name
+        :param hashers: dict of already calculated content hashers
+        :return: path to cached file
+        """
+        meta = self._store(tmp_path, name, hashers=hashers)
+        meta['url'] = key
+        meta['checked_at'] = time.time()
+        key = url_key(key)
+        with self.lock(key):
+            self._write_json(self._meta_path(key), meta)
+        path = self._object_path(meta)
+        self.evict(keep=path)
+        return path
+
+    def make_tmp_file(self):
+        """Create file in cache `tmp` dir, return its fd and path"""
+        return tempfile.mkstemp(dir=os.path.join(self.path, 'tmp'))
+
+    def _fetch(self, url, key, meta, name, checksum):
+        """Download file (if changed) and return new url metadata"""
+        headers = {}
+        if meta is not None:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        response = requests.get(url, stream=True, headers=headers)
+        try:
+            if response.status_code == 304:
+                logger.info("File {} is up to date".format(name))
+            elif response.status_code == 200:
+                validators = {
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get(
+                        'Last-Modified', email.utils.formatdate(usegmt=True)),
+                }
+                size = response.headers.get('Content-Length')
+                size = int(size) if size is not None else None
+                if self._is_segmented(response, size):
+                    response.close()
+                    tmp_path = self._download_segments(url, key, name, size,
+                                                       response.headers)
+                    hashers = None
+                else:
+                    tmp_path, hashers = self._download(response, name, size,
+                                                       checksum)
+                meta = self._store(tmp_path, name, checksum, hashers)
+                meta.update(validators)
+            elif meta is not None:
+                logger.warning("Can't get fresh file {0}. HTTP status code "
+                               "is {1.status_code}".format(name, response))
+            else:
+                raise IOError("Can't download {0}. HTTP status code is "
+                              "{1.status_code}".format(url, response))
+        finally:
+            response.close()
+        meta['url'] = url
+        meta['checked_at'] = time.time()
+        return meta
+
+    def _is_segmented(self, response, size):
+        if self.workers < 2 or size is None:
+            return False
+        if size < 2 * self.min_segment_size:
+            return False
+        return response.headers.get('Accept-Ranges') == 'bytes'
+
+    def _download(self, response, name, size, checksum):
+        """Save response content to temporary file with single connection
+
+        :return: temporary file path and dict of content hashers
+        """
+        progress = DownloadProgress(name, total=size)
+        hashers = {'sha256': hashlib.sha256()}
+        if checksum is not None:
+            algorithm = parse_checksum(checksum)[0]
+            hashers.setdefault(algorithm, hashlib.new(algorithm))
+        fd, tmp_path = self.make_tmp_file()
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    for hasher in hashers.values():
+                        hasher.update(chunk)
+                    f.write(chunk)
+                    progress.add(len(chunk))
+            if size is not None and progress.done != size:
+                raise IOError("Download of {0} is incomplete: got {1} of {2} "
+                              "bytes".format(name, progress.done, size))
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        progress.log_finish()
+        return tmp_path, hashers
+
+    def _download_segments(self, url, key, name, size, headers):
+        """Download file with parallel Range requests
+
+        Segments state is saved to `tmp/<url key>.state.json` on failure,
+        so next call continues download of same file version.
+
+        :return: temporary file path
+        """
+        part_path = os.path.join(self.path, 'tmp', key + '.part')
+        state_path = os.path.join(self.path, 'tmp', key + '.state.json')
+        # If-Range makes server return whole file (200) instead of part if
+        # file is changed, weak ETag can't be used for it
+        validator = headers.get('ETag')
+        if validator is None or validator.startswith('W/'):
+            validator = headers.get('Last-Modified')
+        state = self._read_json(state_path)
+        resumable = False
+        if state is not None and os.path.exists(part_path):
+            version = (state['size'], state['validator'])
+            resumable = version == (size, validator)
+        if not resumable:
+            segments_count = min(self.workers * 4,
+                                 size // self.min_segment_size)
+            segment_size = size // segments_count + 1
+            state = {
+                'size': size,
+                'validator': validator,
+                'segments': [
+                    {'start': start,
+                     'end': min(start + segment_size, size) - 1,
+                     'done': 0}
+                    for start in range(0, size, segment_size)],
+            }
+            with open(part_path, 'wb') as f:
+                f.truncate(size)
+        else:
+            logger.info('Resume downloading {}'.format(name))
+
+        progress = DownloadProgress(
+            name, total=size, done=sum(x['done'] for x in state['segments']))
+        executor = ParallelExecutor(max_workers=self.workers, fail_fast=True)
+        try:
+            executor.map(
+                lambda x: self._download_segment(url, part_path, x, validator,
+                                                 progress),
+                [x for x in state['segments']
+                 if x['start'] + x['done'] <= x['end']])
+        except BaseException:
+            self._write_json(state_path, state)
+            raise
+        if os.path.exists(state_path):
+            os.remove(state_path)
+        progress.log_finish()
+        return part_path
+
+    def _download_segment(self, url, path, segment, validator, progress):
+        """Download bytes from `start` + `done` to `end` of segment"""
+        for attempt in range(1, self.retries + 1):
+            offset = segment['start'] + segment['done']
+            headers = {'Range': 'bytes={0}-{1}'.format(offset, segment['end'])}
+            if validator is not None:
+                headers['If-Range'] = validator
+            try:
+                response = requests.get(url, stream=True, headers=headers,
+                                        timeout=60)
+                try:
+                    if response.status_code == 200:
+                        raise IOError("File {0} is changed on server during "
+                                      "download".format(url))
+                    elif response.status_code != 206:
+                        response.raise_for_status()
+                        raise IOError(
+                            "Can't get {0} of {1}. HTTP status code is "
+                            "{2.status_code}".format(headers['Range'], url,
+                                                     response))
+                    with open(path, 'r+b') as f:
+                        f.seek(offset)
+                        for chunk in response.iter_content(CHUNK_SIZE):
+                            f.write(chunk)
+                            segment['done'] += len(chunk)
+                            progress.add(len(chunk))
+                finally:
+                    response.close()
+            except requests.RequestException as e:
+                logger.warning('Attempt {0} to download {1} of {2} '
+                               'failed: {3}'.format(attempt, headers['Range'],
+                                                    url, e))
+            if segment['start'] + segment['done'] > segment['end']:
+                return
+        raise IOError("Can't download bytes {0}-{1} of {2} in {3} "
+                      "attempts".format(segment['start'], segment['end'],
+                                        url, self.retries))
+
+    def _store(self, tmp_path, name, checksum=None, hashers=None):
+        """Verify downloaded file and move it to objects
+
+        :param hashers: dict of already calculated content hashers, file is
+            read again to calculate hashes if it is None
+        :return: metadata of stored object
+        """
+        try:
+            if hashers is None:
+                hashers = {'sha256': hashlib.sha256()}
+                if checksum is not None:
+                    algorithm = parse_checksum(checksum)[0]
+                    hashers.setdefault(algorithm, hashlib.new(algorithm))
+                with open(tmp_path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                        for hasher in hashers.values():
+                            hasher.update(chunk)
+            if checksum is not None:
+                algorithm, digest = parse_checksum(checksum)
+                if hashers[algorithm].hexdigest() != digest:
+                    raise IOError("Checksum mismatch for {0}: expected {1}, "
+                                  "got {2}".format(
+                                      name, checksum,
+                                      hashers[algorithm].hexdigest()))
+            meta = {'sha256': hashers['sha256'].hexdigest(),
+                    'name': name,
+                    'size': os.path.getsize(tmp_path)}
+            path = self._object_path(meta)
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            os.rename(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return meta
+
+    def _clean_tmp(self):
+        """Remove expired temporary files, return size of remaining ones"""
+        tmp_dir = os.path.join(self.path, 'tmp')
+        expired = time.time() - self.tmp_max_age
+        total = 0
+        for name in os.listdir(tmp_dir):
+            path = os.path.join(tmp_dir, name)
+            try:
+                stat = os.stat(path)
+                if stat.st_mtime < expired:
+                    logger.info('Remove stale {} from files cache'.format(
+                        path))
+                    os.remove(path)
+                else:
+                    total += stat.st_size
+            except OSError:
+                # removed by concurrent process
+                continue
+        return total
+
+    def evict(self, keep=None):
+        """Remove least recently used files while cache exceeds size budget
+
+        Partially downloaded files are counted too and removed after
+        `tmp_max_age` seconds without changes.
+
+        :param keep: path of file, which should not be removed
+        """
+        with self.lock('evict'):
+            tmp_size = self._clean_tmp()
+            objects_dir = os.path.join(self.path, 'objects')
+            entries = []
+            for sha in os.listdir(objects_dir):
+                entry = os.path.join(objects_dir, sha)
+                size = sum(os.path.getsize(os.path.join(entry, x))
+                           for x in os.listdir(entry))
+                entries.append((os.path.getmtime(entry), size, entry))
+            total = tmp_size + sum(x[1] for x in entries)
+            recent = time.time() - self.evict_grace_period
+            for mtime, size, entry in sorted(entries):
+                if total <= self.max_size:
+                    break
+                if keep is not None and os.path.dirname(keep) == entry:
+                    continue
+                if mtime > recent:
+                    # all other entries are used recently too
+                    break
+                logger.info('Evict {} from files cache'.format(entry))
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= size
+
+
+def get_cache():
+    return FileCache(settings.TEST_IMAGE_PATH,
+                     max_size=settings.TEST_IMAGE_CACHE_SIZE,
+                     ttl=settings.TEST_IMAGE_CACHE_TTL,
+                     workers=settings.TEST_IMAGE_DOWNLOAD_THREADS)
+
+
+@contextmanager
+def get_file(url, name=None, checksum=None):
+    with open(get_file_path(url, name, checksum), 'rb') as f:
+        yield f
+
 
-    response.close()
-    return file_path
+def get_file_path(url, name=None, checksum=None):
+    try:
+        cache = get_cache()
+    except Exception as e:
+        logger.warning("Can't make dir for files: {}".format(e))
+        return None
+    return cache.get_file_path(url, name, checksum)
 
 
 def get_file_name(url):
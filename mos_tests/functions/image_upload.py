@@ -0,0 +1,236 @@
+#    Copyright 2016 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import hashlib
+import logging
+import os
+import sys
+import tarfile
+import threading
+import time
+
+import six
+from six.moves.queue import Full
+from six.moves.queue import Queue
+
+from mos_tests.functions import file_cache
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 ** 2
+MiB = 1024 ** 2
+
+# Marker of data end in pipeline queue
+EOF = object()
+
+
+class StageStats(object):
+    """Bytes and time counters of one pipeline stage
+
+    :param name: stage name for report
+    :param waits_for: name of stage, which this stage waits for
+    """
+
+    def __init__(self, name, waits_for):
+        self.name = name
+        self.waits_for = waits_for
+        self.bytes = 0
+        self.waited = 0
+        self.started = self.finished = None
+
+    def report(self):
+        duration = max(self.finished - self.started, 1e-3)
+        logger.info('{0.name}: {1:.1f} MiB in {2:.0f}s, {3:.1f} MiB/s, '
+                    'waited for {0.waits_for} {0.waited:.0f}s'.format(
+                        self, self.bytes / float(MiB), duration,
+                        self.bytes / float(MiB) / duration))
+
+
+class QueueReader(object):
+    """File-like object, which reads data chunks from pipeline queue
+
+    Reader raises IOError instead of data end, if producer failed, so
+    consumer doesn't save truncated data.
+    """
+
+    def __init__(self, queue, stats, errors):
+        self.queue = queue
+        self.stats = stats
+        self.errors = errors
+        self.buffer = b''
+        self.eof = False
+
+    def _get(self):
+        start = time.time()
+        chunk = self.queue.get()
+        self.stats.waited += time.time() - start
+        if chunk is EOF:
+            if self.errors:
+                raise IOError('Data producer failed')
+            self.eof = True
+            return b''
+        return chunk
+
+    def read(self, size=-1):
+        while not self.eof and (size < 0 or len(self.buffer) < size):
+            self.buffer += self._get()
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        self.stats.bytes += len(data)
+        return data
+
+    def __iter__(self):
+        while True:
+            data = self.read(CHUNK_SIZE)
+            if not data:
+                return
+            yield data
+
+
+class Pipeline(object):
+    """Produce data and consume it concurrently in separate threads
+
+    Stages are joined by bounded queue, so fast producer doesn't fill
+    memory, and each stage reports its throughput and time, which it waited
+    for other stage (so bottleneck is visible in log).
+
+    :param produce: function, which returns iterator over data chunks
+    :param consume: function, which takes file-like object with data
+    :param name: name of producer stage for report
+    :param consumer_name: name of consumer stage for report
+    :param queue_size: max count of chunks between stages
+    """
+
+    def __init__(self, produce, consume, name='read', consumer_name='upload',
+                 queue_size=16):
+        self.produce = produce
+        self.consume = consume
+        self.queue = Queue(maxsize=queue_size)
+        self.stop = threading.Event()
+        self.errors = []
+        self.producer_stats = StageStats(name, waits_for=consumer_name)
+        self.consumer_stats = StageStats(consumer_name, waits_for=name)
+
+    def _put(self, chunk):
+        """Put chunk to queue, return False if consumer is stopped"""
+        start = time.time()
+        try:
+            while not self.stop.is_set():
+                try:
+                    self.queue.put(chunk, timeout=1)
+                    return True
+                except Full:
+                    pass
+            return False
+        finally:
+            self.producer_stats.waited += time.time() - start
+
+    def _run_producer(self):
+        stats = self.producer_stats
+        stats.started = time.time()
+        try:
+            for chunk in self.produce():
+                stats.bytes += len(chunk)
+                if not self._put(chunk):
+                    break
+        except Exception:
+            self.errors.append(sys.exc_info())
+        finally:
+            self._put(EOF)
+            stats.finished = time.time()
+
+    def _run_consumer(self):
+        stats = self.consumer_stats
+        stats.started = time.time()
+        try:
+            self.consume(QueueReader(self.queue, stats, self.errors))
+        except Exception:
+            self.errors.append(sys.exc_info())
+        finally:
+            self.stop.set()
+            stats.finished = time.time()
+
+    def run(self):
+        """Run both stages and wait them, re-raise first stage error"""
+        threads = [threading.Thread(target=self._run_producer),
+                   threading.Thread(target=self._run_consumer)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.producer_stats.report()
+        self.consumer_stats.report()
+        if self.errors:
+            six.reraise(*self.errors[0])
+
+
+def iter_file(path):
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            yield chunk
+
+
+def upload_tar_image(glance, image_id, url, queue_size=16):
+    """Upload first file from tar.gz archive to glance image
+
+    Archive is downloaded to files cache. Extracted image is saved to cache
+    during first upload, so later uploads read it without decompression.
+
+    :param glance: glance v2 client
+    :param image_id: id of glance image with `queued` status
+    :param url: url of tar.gz archive
+    :param queue_size: max count of 1 MiB chunks between stages
+    """
+    cache = file_cache.get_cache()
+    tar_path = cache.get_file_path(url)
+    # object dir name is archive content hash
+    key = 'extracted:{}'.format(os.path.basename(os.path.dirname(tar_path)))
+
+    def upload(data):
+        glance.images.upload(image_id, data)
+
+    raw_path = cache.get_cached_path(key)
+    if raw_path is not None:
+        logger.info('Use extracted image {} from cache'.format(raw_path))
+        Pipeline(lambda: iter_file(raw_path), upload,
+                 queue_size=queue_size).run()
+        return
+
+    extracted = {}
+    fd, tmp_path = cache.make_tmp_file()
+
+    def extract():
+        sha256 = hashlib.sha256()
+        with os.fdopen(fd, 'wb') as raw, tarfile.open(tar_path,
+                                                      mode='r|gz') as tar:
+            member = tar.firstmember
+            extracted['name'] = os.path.basename(member.name)
+            src = tar.extractfile(member)
+            for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+                sha256.update(chunk)
+                raw.write(chunk)
+                yield chunk
+        extracted['hashers'] = {'sha256': sha256}
+
+    try:
+        Pipeline(extract, upload, name='decompress',
+                 queue_size=queue_size).run()
+        if 'hashers' in extracted:
+            cache.put(key, tmp_path, extracted['name'],
+                      hashers=extracted['hashers'])
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
@@ -12,10 +12,14 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+from collections import namedtuple
 import logging
+import re
 
 import six
+from waiting import TimeoutExpired
 
+from mos_tests.environment.ssh import ParallelExecutor
 from mos_tests.functions.common import wait
 from mos_tests import settings
 
@@ -99,15 +103,104 @@ def check_ping_from_vm_helper(env, os_conn, vm, vm_keypair, ip_to_ping,
     return res
 
 
+# `loss` - packet loss in percents, `rtt` - average round trip time in ms
+# (None if there is no replies)
+PingResult = namedtuple('PingResult', ['loss', 'rtt'])
+
+
+def parse_ping_output(output):
+    """Parse output of `ping_all_command` to dict with PingResult for ip"""
+    results = {}
+    for section in re.split(r'^### ', output, flags=re.MULTILINE)[1:]:
+        ip, _, ping_output = section.partition('\n')
+        loss = re.search(r'([\d.]+)% packet loss', ping_output)
+        rtt = re.search(r'= [\d.]+/([\d.]+)/', ping_output)
+        results[ip.strip()] = PingResult(
+            loss=float(loss.group(1)) if loss else 100.0,
+            rtt=float(rtt.group(1)) if rtt else None)
+    return results
+
+
+def ping_all_command(ips, count=3):
+    """Return shell command to ping all ips simultaneously
+
+    Output of each ping is printed after `### <ip>` header.
+    """
+    ips = ' '.join(ips)
+    return ('d=$(mktemp -d); '
+            'for ip in {ips}; do ping -c {count} -w {deadline} $ip '
+            '> $d/$ip 2>&1 & done; wait; '
+            'for ip in {ips}; do echo "### $ip"; cat $d/$ip; done; '
+            'rm -rf $d').format(ips=ips, count=count, deadline=count + 5)
+
+
+def ping_from_vm(env, os_conn, vm, ips_to_ping, vm_keypair=None, count=3,
+                 timeout=3 * 60, vm_login='cirros', vm_password='cubswin:)'):
+    """Ping all ips simultaneously from vm
+
+    Repeat pings until all ips are reachable or timeout is reached.
+
+    :return: dict with PingResult for each ip
+    """
+    cmd = ping_all_command(ips_to_ping, count=count)
+    results = []
+
+    def is_all_reachable():
+        # single try, retries are made by outer wait
+        result = run_on_vm(env, os_conn, vm, vm_keypair, cmd,
+                           vm_login=vm_login, vm_password=vm_password,
+                           timeout=None)
+        results.append(parse_ping_output(''.join(result['stdout'])))
+        return all(x.loss < 100 for x in results[-1].values())
+
+    try:
+        wait(is_all_reachable, timeout_seconds=timeout, sleep_seconds=5,
+             expected_exceptions=(Exception,),
+             waiting_for='all ips are reachable from {0}'.format(vm.name))
+    except TimeoutExpired:
+        if not results:
+            raise
+    return results[-1]
+
+
+def get_vms_connectivity(env, os_conn, servers, vm_keypair=None,
+                         extra_ips=(), timeout=4 * 60, max_workers=8):
+    """Ping from each vm all other vms and extra ips, all vms at once
+
+    `max_workers` should be less than sshd MaxSessions on DHCP nodes,
+    because all instances of network are reached through one connection.
+
+    :return: reachability matrix - dict with (vm name, vm id) as keys and
+        dicts with PingResult for each pinged ip as values
+    """
+    ips = {server.id: list(os_conn.get_nova_instance_ips(server).values())
+           for server in servers}
+
+    def ping(server):
+        ips_to_ping = list(extra_ips)
+        for other in servers:
+            if other.id != server.id:
+                ips_to_ping += ips[other.id]
+        return ping_from_vm(env, os_conn, server, ips_to_ping,
+                            vm_keypair=vm_keypair, timeout=timeout)
+
+    executor = ParallelExecutor(max_workers=max_workers)
+    results = executor.map(ping, servers)
+    # names of vms may be the same, so id is a part of key
+    return {(server.name, server.id): result
+            for server, result in zip(servers, results)}
+
+
 def check_vm_connectivity(env, os_conn, vm_keypair=None, timeout=4 * 60):
     """Check that all vms can ping each other and public ip"""
     servers = os_conn.get_servers()
-    for server1 in servers:
-        ips_to_ping = [settings.PUBLIC_TEST_IP]
-        for server2 in servers:
-            if server1 == server2:
-                continue
-            ips_to_ping += os_conn.get_nova_instance_ips(
-                server2).values()
-        check_ping_from_vm(env, os_conn, server1, vm_keypair, ips_to_ping,
-                           timeout=timeout)
+    matrix = get_vms_connectivity(env, os_conn, servers, vm_keypair,
+                                  extra_ips=[settings.PUBLIC_TEST_IP],
+                                  timeout=timeout)
+    unreachable = {'{0} ({1})'.format(*key):
+                   sorted(ip for ip, result in row.items()
+                          if result.loss == 100)
+                   for key, row in matrix.items()}
+    unreachable = {k: v for k, v in unreachable.items() if v}
+    assert not unreachable, 'Unreachable ips from vms: {0}'.format(
+        unreachable)
@@ -19,6 +19,7 @@ import pytest
 from six.moves import configparser
 from tempest.lib.cli import base
 
+from mos_tests.environment.ssh import ParallelExecutor
 from mos_tests.functions import common
 from mos_tests.functions import os_cli
 
@@ -64,12 +65,11 @@ def short_lifetime_keystone(env):
                     expected_exceptions=Exception)
 
     controllers = env.get_nodes_by_role('controller')
-    for controller in controllers:
-        set_lifetime(controller)
+    executor = ParallelExecutor(fail_fast=True)
+    executor.map(set_lifetime, controllers)
     wait_keystone_alive()
     yield
-    for controller in controllers:
-        reset_lifetime(controller)
+    executor.map(reset_lifetime, controllers)
     wait_keystone_alive()
 
 
@@ -14,14 +14,13 @@
 
 import json
 import logging
-import tarfile
 
 import ipaddress
 import pytest
 
 from mos_tests.environment.os_actions import OpenStackActions
 from mos_tests.functions import common
-from mos_tests.functions import file_cache
+from mos_tests.functions import image_upload
 from mos_tests.ironic import actions
 from mos_tests.ironic import conftest
 from mos_tests import settings
@@ -184,10 +183,8 @@ def env2_ubuntu_image(env2, image_file):
         cpu_arch='x86_64',
         fuel_disk_info=json.dumps(settings.IRONIC_GLANCE_DISK_INFO))
 
-    with file_cache.get_file(settings.IRONIC_IMAGE_URL) as src:
-        with tarfile.open(fileobj=src, mode='r|gz') as tar:
-            img = tar.extractfile(tar.firstmember)
-            env2.os_conn.glance.images.upload(image.id, img)
+    image_upload.upload_tar_image(env2.os_conn.glance, image.id,
+                                  settings.IRONIC_IMAGE_URL)
 
     logger.info('Creating ubuntu image ... done')
 
@@ -14,9 +14,8 @@
 
 import json
 import logging
-import tarfile
 
-from mos_tests.functions import file_cache
+from mos_tests.functions import image_upload
 from mos_tests import settings
 
 logger = logging.getLogger(__name__)
@@ -35,10 +34,8 @@ def ubuntu_image(os_conn):
         cpu_arch='x86_64',
         fuel_disk_info=json.dumps(settings.IRONIC_GLANCE_DISK_INFO))
 
-    with file_cache.get_file(settings.IRONIC_IMAGE_URL) as src:
-        with tarfile.open(fileobj=src, mode='r|gz') as tar:
-            img = tar.extractfile(tar.firstmember)
-            os_conn.glance.images.upload(image.id, img)
+    image_upload.upload_tar_image(os_conn.glance, image.id,
+                                  settings.IRONIC_IMAGE_URL)
 
     logger.info('Creating ubuntu image ... done')
 
@@ -85,8 +85,9 @@ class PingThread(threading.Thread):
     def run(self):
         remote = self.remote
         command = 'ping {0} 2&>1'.format(self.ip_to_ping)
-        self.chan, self.stdin, stdout, _ = remote.execute_async(command)
-        for line in stdout:
+        self.chan, self.stdin, _, _ = remote.execute_async(command,
+                                                           merge_stderr=True)
+        for line in remote.iter_lines(self.chan):
             self.stdout_q.put(line)
 
     def stop(self):
@@ -14,8 +14,6 @@
 
 import re
 import subprocess
-from time import sleep
-from time import time
 
 import paramiko
 import pytest
@@ -286,19 +284,12 @@ class NovaIntegrationTests(OpenStackTestCase):
                                  max_count=count,
                                  security_groups=[self.sec_group.name],
                                  nics=[{"net-id": net_internal_id}])
-        start_time = time()
-        timeout = 5
-        while len(self.nova.servers.list()) < len(initial_instances) + count \
-                and time() < start_time + timeout * 60:
-            sleep(5)
-
         instances = [inst for inst in self.nova.servers.list()
                      if inst not in initial_instances]
         self.instances = [inst.id for inst in instances]
-        for inst_id in self.instances:
-            self.assertTrue(common_functions.check_inst_status(self.nova,
-                                                               inst_id,
-                                                               'ACTIVE'))
+        self.assertEqual(len(self.instances), count)
+        instances = self.os_conn.wait_servers_active(self.instances,
+                                                     timeout=5 * 60)
         fip_dict = {}
         for inst in instances:
             fip = fip_new.pop()
@@ -327,7 +318,6 @@ class NovaIntegrationTests(OpenStackTestCase):
             5. Add the floating ips to the instances
             6. Ping the instances by the floating ips
         """
-        initial_instances = self.nova.servers.list()
         count = 10
         primary_name = "testVM_543357"
         image_dict = {im.name: im.id for im in self.nova.images.list()}
@@ -355,23 +345,14 @@ class NovaIntegrationTests(OpenStackTestCase):
 
         for volume in self.volumes:
             bdm = {'vda': volume.id}
-            self.nova.servers.create(primary_name, '', flavor_id,
-                                     security_groups=[self.sec_group.name],
-                                     block_device_mapping=bdm,
-                                     nics=[{"net-id": net_internal_id}])
-        start_time = time()
-        timeout = 5
-        while len(self.nova.servers.list()) < len(initial_instances) + count \
-                and time() < start_time + timeout * 60:
-            sleep(5)
-
-        instances = [inst for inst in self.nova.servers.list()
-                     if inst not in initial_instances]
-        self.instances = [inst.id for inst in instances]
-        for inst_id in self.instances:
-            self.assertTrue(common_functions.check_inst_status(self.nova,
-                                                               inst_id,
-                                                               'ACTIVE'))
+            inst = self.nova.servers.create(
+                primary_name, '', flavor_id,
+                security_groups=[self.sec_group.name],
+                block_device_mapping=bdm,
+                nics=[{"net-id": net_internal_id}])
+            self.instances.append(inst.id)
+        instances = self.os_conn.wait_servers_active(self.instances,
+                                                     timeout=5 * 60)
         fip_dict = {}
         for inst in instances:
             fip = fip_new.pop()
@@ -35,6 +35,12 @@ PUBLIC_TEST_IP = os.environ.get('PUBLIC_TEST_IP', '8.8.8.8')
 
 # Path to folder with required images
 TEST_IMAGE_PATH = os.environ.get("TEST_IMAGE_PATH", os.path.expanduser('~/images'))  # noqa
+# Max size of cached files in bytes
+TEST_IMAGE_CACHE_SIZE = int(os.environ.get("TEST_IMAGE_CACHE_SIZE", 50 * 1024 ** 3))  # noqa
+# Seconds to use cached file without checking for update on server
+TEST_IMAGE_CACHE_TTL = int(os.environ.get("TEST_IMAGE_CACHE_TTL", 6 * 60 * 60))  # noqa
+# Count of parallel connections to download big files
+TEST_IMAGE_DOWNLOAD_THREADS = int(os.environ.get("TEST_IMAGE_DOWNLOAD_THREADS", 4))  # noqa
 UBUNTU_IPERF_QCOW2 = 'ubuntu-iperf.qcow2'
 UBUNTU_QCOW2_URL = 'https://cloud-images.ubuntu.com/trusty/current/trusty-server-cloudimg-amd64-disk1.img'  # noqa
 FEDORA_DOCKER_URL = 'http://tarballs.openstack.org/heat-test-image/fedora-heat-test-image.qcow2'  # noqa
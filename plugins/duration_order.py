@@ -0,0 +1,85 @@
+#    Copyright 2016 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+__doc__ = """This module orders tests by their historical duration.
+
+Tests durations (setup + call + teardown) are saved to pytest cache after
+each run. With `--duration-order` option tests are ordered from longest to
+shortest, so pytest-xdist workers get balanced load (long tests are
+started first, short ones fill the gaps at the end). Tests without saved
+duration are considered as the longest ones. Tests from `incremental`
+classes are kept together.
+"""
+
+from collections import defaultdict
+
+import pytest
+
+CACHE_KEY = 'mos_tests/durations'
+
+
+def pytest_addoption(parser):
+    parser.addoption("--duration-order", action="store_true",
+                     help="Run longest (by previous runs) tests first")
+
+
+def is_xdist_worker(config):
+    return any(hasattr(config, x) for x in ('slaveinput', 'workerinput'))
+
+
+class DurationsRecorder(object):
+    """Collect tests durations and save them to cache on session finish"""
+
+    def __init__(self, config):
+        self.config = config
+        self.durations = defaultdict(float)
+
+    def pytest_runtest_logreport(self, report):
+        self.durations[report.nodeid] += report.duration
+
+    def pytest_sessionfinish(self, session):
+        if not self.durations:
+            return
+        saved = self.config.cache.get(CACHE_KEY, {})
+        saved.update(self.durations)
+        self.config.cache.set(CACHE_KEY, saved)
+
+
+def pytest_configure(config):
+    # with xdist durations are collected by master from workers reports
+    if not is_xdist_worker(config):
+        config.pluginmanager.register(DurationsRecorder(config),
+                                      'durations_recorder')
+
+
+def group_key(item):
+    if getattr(item, 'cls', None) is not None and \
+            'incremental' in item.keywords:
+        return item.parent
+    return item
+
+
+# run before other reordering plugins, so they can refine this order
+@pytest.hookimpl(tryfirst=True)
+def pytest_collection_modifyitems(session, config, items):
+    if not config.getoption("--duration-order"):
+        return
+    saved = config.cache.get(CACHE_KEY, {})
+    unknown = float('inf')
+    group_durations = defaultdict(float)
+    for item in items:
+        group_durations[group_key(item)] += saved.get(item.nodeid, unknown)
+
+    # sort is stable, so equal groups keep collection order on all workers
+    items[:] = sorted(items, key=lambda x: -group_durations[group_key(x)])
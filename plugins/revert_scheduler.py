@@ -0,0 +1,105 @@
+#    Copyright 2016 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+__doc__ = """This module reorders tests to minimize environment reverts.
+
+Each destructive test (without `undestructive` marker) is followed by
+snapshot revert. Test may declare, what exactly it breaks with `dirties`
+marker, so lighter repair can be used instead of full revert:
+
+@pytest.mark.dirties('network')          # < only neutron resources created
+def test_a():
+    pass
+
+@pytest.mark.dirties('service-restart')  # < services restarted, but nothing
+def test_b():                            # else changed
+    pass
+
+@pytest.mark.dirties('node-destroy')     # < nodes destroyed, revert needed
+def test_c():
+    pass
+
+With `--minimize-reverts` option tests are ordered:
+undestructive first, then destructive by repair cost (lightest first),
+tests without `dirties` marker last. Tests from `incremental` classes are
+kept together.
+"""
+
+# Ordered from lightest repair to heaviest
+SCOPES = ('network', 'service-restart', 'node-destroy')
+
+UNDESTRUCTIVE = -1
+FULL_REVERT = len(SCOPES)
+
+
+def pytest_addoption(parser):
+    parser.addoption("--minimize-reverts", action="store_true",
+                     help="Reorder tests to minimize environment reverts")
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers",
+        "dirties(scope): declare what destructive test breaks, one of "
+        "{}".format(', '.join(SCOPES)))
+
+
+def get_dirties_scope(item):
+    """Return declared `dirties` scope of test or None
+
+    :param item: pytest test item
+    """
+    marker = item.get_marker('dirties')
+    if marker is None:
+        return None
+    scope = marker.args[0]
+    if scope not in SCOPES:
+        raise ValueError('Unknown dirties scope {0!r} for {1}, expected '
+                         'one of {2}'.format(scope, item.nodeid, SCOPES))
+    return scope
+
+
+def revert_cost(item):
+    """Return cost rank of environment repair after test"""
+    if 'undestructive' in item.keywords:
+        return UNDESTRUCTIVE
+    scope = get_dirties_scope(item)
+    if scope is None:
+        return FULL_REVERT
+    return SCOPES.index(scope)
+
+
+def group_key(item):
+    if getattr(item, 'cls', None) is not None and \
+            'incremental' in item.keywords:
+        return item.parent
+    return item
+
+
+def pytest_collection_modifyitems(session, config, items):
+    for item in items:
+        # validate markers even if reordering is disabled
+        get_dirties_scope(item)
+    if not config.getoption("--minimize-reverts"):
+        return
+
+    # incremental classes must run in their own order, so whole class
+    # gets the cost of its most destructive test
+    group_costs = {}
+    for item in items:
+        key = group_key(item)
+        group_costs[key] = max(group_costs.get(key, UNDESTRUCTIVE),
+                               revert_cost(item))
+
+    # sort is stable, so original order is kept inside each cost group
+    items[:] = sorted(items, key=lambda x: group_costs[group_key(x)])
@@ -0,0 +1,50 @@
+pytest_plugins = "pytester"
+
+
+TESTS = """
+    import time
+
+    def test_short():
+        pass
+
+    def test_long():
+        time.sleep(0.3)
+
+    def test_medium():
+        time.sleep(0.1)
+"""
+
+
+def test_durations_order(testdir):
+    testdir.makepyfile(TESTS)
+    testdir.runpytest("-p", "plugins.duration_order")
+    result = testdir.runpytest("-p", "plugins.duration_order", "--verbose",
+                               "--duration-order")
+    result.stdout.fnmatch_lines([
+        "*::test_long PASSED",
+        "*::test_medium PASSED",
+        "*::test_short PASSED",
+    ])
+
+
+def test_unknown_tests_first(testdir):
+    testdir.makepyfile(TESTS)
+    testdir.runpytest("-p", "plugins.duration_order", "-k", "not medium")
+    result = testdir.runpytest("-p", "plugins.duration_order", "--verbose",
+                               "--duration-order")
+    result.stdout.fnmatch_lines([
+        "*::test_medium PASSED",
+        "*::test_long PASSED",
+        "*::test_short PASSED",
+    ])
+
+
+def test_order_not_changed_by_default(testdir):
+    testdir.makepyfile(TESTS)
+    testdir.runpytest("-p", "plugins.duration_order")
+    result = testdir.runpytest("-p", "plugins.duration_order", "--verbose")
+    result.stdout.fnmatch_lines([
+        "*::test_short PASSED",
+        "*::test_long PASSED",
+        "*::test_medium PASSED",
+    ])
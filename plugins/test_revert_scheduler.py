@@ -0,0 +1,102 @@
+pytest_plugins = "pytester"
+
+
+TESTS = """
+    import pytest
+
+    def test_destructive():
+        pass
+
+    @pytest.mark.dirties('node-destroy')
+    def test_node_destroy():
+        pass
+
+    @pytest.mark.undestructive
+    def test_undestructive_a():
+        pass
+
+    @pytest.mark.dirties('network')
+    def test_network():
+        pass
+
+    @pytest.mark.dirties('service-restart')
+    def test_service_restart():
+        pass
+
+    @pytest.mark.undestructive
+    def test_undestructive_b():
+        pass
+"""
+
+
+def test_order_not_changed_by_default(testdir):
+    testdir.makepyfile(TESTS)
+    result = testdir.runpytest("-p", "plugins.revert_scheduler", "--verbose")
+    result.stdout.fnmatch_lines([
+        "*::test_destructive PASSED",
+        "*::test_node_destroy PASSED",
+        "*::test_undestructive_a PASSED",
+        "*::test_network PASSED",
+        "*::test_service_restart PASSED",
+        "*::test_undestructive_b PASSED",
+    ])
+
+
+def test_order_by_revert_cost(testdir):
+    testdir.makepyfile(TESTS)
+    result = testdir.runpytest("-p", "plugins.revert_scheduler", "--verbose",
+                               "--minimize-reverts")
+    result.stdout.fnmatch_lines([
+        "*::test_undestructive_a PASSED",
+        "*::test_undestructive_b PASSED",
+        "*::test_network PASSED",
+        "*::test_service_restart PASSED",
+        "*::test_node_destroy PASSED",
+        "*::test_destructive PASSED",
+    ])
+
+
+def test_incremental_class_kept_together(testdir):
+    testdir.makepyfile("""
+        import pytest
+        pytest_plugins = "plugins.incremental"
+
+        @pytest.mark.incremental
+        class TestSmth(object):
+
+            @pytest.mark.undestructive
+            def test_a(self):
+                pass
+
+            @pytest.mark.dirties('network')
+            def test_b(self):
+                pass
+
+        @pytest.mark.dirties('service-restart')
+        def test_c():
+            pass
+
+        @pytest.mark.undestructive
+        def test_d():
+            pass
+    """)
+    result = testdir.runpytest("-p", "plugins.revert_scheduler", "--verbose",
+                               "--minimize-reverts")
+    result.stdout.fnmatch_lines([
+        "*::test_d PASSED",
+        "*::test_a PASSED",
+        "*::test_b PASSED",
+        "*::test_c PASSED",
+    ])
+
+
+def test_unknown_scope(testdir):
+    testdir.makepyfile("""
+        import pytest
+
+        @pytest.mark.dirties('everything')
+        def test_a():
+            pass
+    """)
+    result = testdir.runpytest("-p", "plugins.revert_scheduler")
+    result.stdout.fnmatch_lines(["*Unknown dirties scope 'everything'*"])
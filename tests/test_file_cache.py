@@ -0,0 +1,213 @@
+import hashlib
+import os
+import re
+import threading
+import time
+
+import pytest
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+
+from mos_tests.functions.file_cache import FileCache
+
+
+class RangeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves `server.content` with Range and If-Range support"""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.headers.get('Range'))
+        content = server.content
+        etag = '"{}"'.format(hashlib.md5(content).hexdigest())
+        range_header = self.headers.get('Range')
+        if range_header and self.headers.get('If-Range', etag) == etag:
+            if server.fail_ranges > 0:
+                server.fail_ranges -= 1
+                self.send_response(500)
+                self.end_headers()
+                return
+            start, end = re.match(r'bytes=(\d+)-(\d+)',
+                                  range_header).groups()
+            body = content[int(start):int(end) + 1]
+            self.send_response(206)
+        else:
+            body = content
+            self.send_response(200)
+            self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+        if not range_header and server.content_after_get is not None:
+            server.content = server.content_after_get
+
+
+class RangeServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, content):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           RangeHandler)
+        self.content = content
+        # content will be replaced with it after first full response
+        self.content_after_get = None
+        self.fail_ranges = 0
+        self.requests = []
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/image.img'.format(self.server_port)
+
+
+@pytest.yield_fixture
+def server():
+    server = RangeServer(os.urandom(64 * 1024))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def cache(tmpdir):
+    return FileCache(str(tmpdir), max_size=10 * 1024 ** 2, ttl=0, workers=4,
+                     min_segment_size=4 * 1024, retries=1)
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def tmp_files(cache):
+    return os.listdir(os.path.join(cache.path, 'tmp'))
+
+
+def test_segmented_download(cache, server):
+    path = cache.get_file_path(server.url)
+    assert read(path) == server.content
+    ranges = [x for x in server.requests if x is not None]
+    assert len(ranges) == 16
+    assert tmp_files(cache) == []
+
+
+def test_resume_download(cache, server):
+    server.fail_ranges = 3
+    with pytest.raises(IOError):
+        cache.get_file_path(server.url)
+    assert len(tmp_files(cache)) == 2
+
+    del server.requests[:]
+    path = cache.get_file_path(server.url)
+    assert read(path) == server.content
+    # first full GET to check validators, then only missed segments
+    assert server.requests[0] is None
+    assert 0 < len(server.requests[1:]) < 16
+    assert tmp_files(cache) == []
+
+
+def test_abort_if_changed_during_download(cache, server):
+    server.content_after_get = os.urandom(64 * 1024)
+    with pytest.raises(IOError) as e:
+        cache.get_file_path(server.url)
+    assert 'changed' in str(e.value)
+
+
+def test_checksum_mismatch(cache, server):
+    with pytest.raises(IOError) as e:
+        cache.get_file_path(server.url, checksum='md5:' + '0' * 32)
+    assert 'Checksum mismatch' in str(e.value)
+    assert os.listdir(os.path.join(cache.path, 'objects')) == []
+    assert tmp_files(cache) == []
+
+
+def test_checksum_match(cache, server):
+    checksum = 'md5:' + hashlib.md5(server.content).hexdigest()
+    path = cache.get_file_path(server.url, checksum=checksum)
+    assert read(path) == server.content
+
+
+def test_stale_tmp_files_removed(cache, server):
+    server.fail_ranges = 3
+    with pytest.raises(IOError):
+        cache.get_file_path(server.url)
+    stale = time.time() - cache.tmp_max_age - 1
+    for name in tmp_files(cache):
+        os.utime(os.path.join(cache.path, 'tmp', name), (stale, stale))
+    cache.evict()
+    assert tmp_files(cache) == []
+
+
+def put(cache, key, size, age=0):
+    """Put file of `size` bytes to cache, accessed `age` seconds ago"""
+    fd, tmp_path = cache.make_tmp_file()
+    with os.fdopen(fd, 'wb') as f:
+        f.write(os.urandom(size))
+    path = cache.put(key, tmp_path, key)
+    set_access_time(path, time.time() - age)
+    return path
+
+
+def set_access_time(path, atime):
+    os.utime(os.path.dirname(path), (atime, atime))
+
+
+def test_evict_least_recently_used(tmpdir):
+    cache = FileCache(str(tmpdir), max_size=10 * 1024, ttl=0)
+    first = put(cache, 'first', 4 * 1024, age=300)
+    second = put(cache, 'second', 4 * 1024, age=200)
+    # access to the oldest file makes it most recently used
+    assert cache.get_cached_path('first') == first
+    set_access_time(first, time.time() - 100)
+
+    third = put(cache, 'third', 4 * 1024)
+
+    assert os.path.exists(first)
+    assert not os.path.exists(second)
+    assert cache.get_cached_path('second') is None
+    assert os.path.exists(third)
+
+
+def test_evict_keeps_recently_returned(tmpdir):
+    cache = FileCache(str(tmpdir), max_size=10 * 1024, ttl=0)
+    first = put(cache, 'first', 8 * 1024)
+    # path of first file may be used by other process, so cache budget is
+    # exceeded temporarily
+    second = put(cache, 'second', 8 * 1024)
+    assert os.path.exists(first)
+    assert os.path.exists(second)
+
+    set_access_time(first, time.time() - cache.evict_grace_period - 1)
+    cache.evict()
+    assert not os.path.exists(first)
+    assert os.path.exists(second)
+
+
+def test_evict_keeps_requested_file(tmpdir):
+    cache = FileCache(str(tmpdir), max_size=1024, ttl=0)
+    path = put(cache, 'big', 4 * 1024, age=300)
+    cache.evict(keep=path)
+    assert os.path.exists(path)
+
+
+def test_ttl(tmpdir, server):
+    cache = FileCache(str(tmpdir), max_size=10 * 1024 ** 2, ttl=60,
+                      min_segment_size=1024 ** 2)
+    path = cache.get_file_path(server.url)
+    requests_count = len(server.requests)
+
+    # file is not checked on server during ttl
+    assert cache.get_file_path(server.url) == path
+    assert len(server.requests) == requests_count
+
+    # file is checked and updated after ttl
+    server.content = os.urandom(64 * 1024)
+    cache.ttl = 0
+    path = cache.get_file_path(server.url)
+    assert len(server.requests) > requests_count
+    assert read(path) == server.content
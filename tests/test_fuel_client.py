@@ -0,0 +1,147 @@
+from fuelclient.objects import environment
+import pytest
+
+from mos_tests.environment.fuel_client import Environment
+
+
+CRM_MON_OK = """
+Online: [ node-1.test.domain.local node-2.test.domain.local ]
+ Clone Set: clone_p_vip__public [p_vip__public]
+     Started: [ node-1.test.domain.local node-2.test.domain.local ]
+"""
+
+CRM_MON_FAILED = """
+Online: [ node-1.test.domain.local ]
+OFFLINE: [ node-2.test.domain.local ]
+"""
+
+RABBIT_OK = """
+Cluster status of node 'rabbit@messaging-node-1' ...
+[{nodes,[{disc,['rabbit@messaging-node-1','rabbit@messaging-node-2']}]},
+ {running_nodes,['rabbit@messaging-node-2','rabbit@messaging-node-1']},
+ {cluster_name,<<"rabbit@node-1">>}]
+"""
+
+RABBIT_PARTIAL = """
+Cluster status of node 'rabbit@messaging-node-1' ...
+[{nodes,[{disc,['rabbit@messaging-node-1','rabbit@messaging-node-2']}]},
+ {running_nodes,['rabbit@messaging-node-1']}]
+"""
+
+
+class Result(object):
+
+    def __init__(self, stdout, exit_code=0):
+        self.stdout_string = stdout.strip()
+        self.is_ok = exit_code == 0
+
+
+class Remote(object):
+    """SSHClient stub, which requires connection before execute"""
+
+    def __init__(self, outputs):
+        self.outputs = outputs
+        self.connected = False
+
+    def __enter__(self):
+        self.connected = True
+        return self
+
+    def __exit__(self, *err):
+        self.connected = False
+
+    def execute(self, command, **kwargs):
+        if not self.connected:
+            raise AttributeError("'NoneType' object has no attribute "
+                                 "'get_transport'")
+        return self.outputs[command]
+
+
+class Node(object):
+
+    def __init__(self, outputs):
+        self.outputs = outputs
+
+    def ssh(self, pooled=True):
+        return Remote(self.outputs)
+
+
+@pytest.fixture
+def env():
+    return Environment.__new__(Environment)
+
+
+@pytest.mark.parametrize('output, exit_code, expected', [
+    (CRM_MON_OK, 0, True),
+    (CRM_MON_FAILED, 0, False),
+    (CRM_MON_OK, 1, False),
+], ids=['ok', 'offline', 'error'])
+def test_is_pacemaker_ready(env, output, exit_code, expected):
+    node = Node({'crm_mon -1': Result(output, exit_code)})
+    assert env._is_pacemaker_ready(node) is expected
+
+
+@pytest.mark.parametrize('output, expected', [
+    (RABBIT_OK, True),
+    (RABBIT_PARTIAL, False),
+    ('Error: unable to connect to node', False),
+], ids=['ok', 'partial', 'error'])
+def test_is_rabbit_ready(env, output, expected):
+    node = Node({'rabbitmqctl cluster_status': Result(output)})
+    assert env._is_rabbit_ready(node) is expected
+
+
+class FuelNode(object):
+
+    def __init__(self, name, ip):
+        self.data = {'name': name, 'fqdn': '{}.domain.local'.format(name),
+                     'ip': ip, 'mac': ip, 'roles': ['compute']}
+
+
+class FuelNodes(object):
+    """Nodes list in Fuel, which may be changed by test"""
+
+    def __init__(self):
+        self.nodes = [FuelNode('node-1', '10.20.0.3')]
+        self.requests = 0
+
+    def get_all_nodes(self):
+        self.requests += 1
+        return list(self.nodes)
+
+
+@pytest.fixture
+def fuel_nodes(env, monkeypatch):
+    nodes = FuelNodes()
+    monkeypatch.setattr(environment.Environment, 'get_all_nodes',
+                        lambda self: nodes.get_all_nodes())
+    env._inventory = None
+    return nodes
+
+
+@pytest.mark.parametrize('lookup, key', [
+    ('find_node_by_fqdn', 'node-2.domain.local'),
+    ('find_node_by_ip', '10.20.0.4'),
+    ('find_node_by_mac', '10.20.0.4'),
+])
+def test_find_node_refreshes_inventory_on_miss(env, fuel_nodes, lookup,
+                                               key):
+    env.get_all_nodes()
+    fuel_nodes.nodes.append(FuelNode('node-2', '10.20.0.4'))
+    assert getattr(env, lookup)(key).data['name'] == 'node-2'
+    assert fuel_nodes.requests == 2
+
+
+def test_get_node_ip_by_host_name_refreshes_inventory_on_miss(env,
+                                                              fuel_nodes):
+    env.get_all_nodes()
+    fuel_nodes.nodes.append(FuelNode('node-2', '10.20.0.4'))
+    assert env.get_node_ip_by_host_name('node-2.domain.local') == '10.20.0.4'
+    assert env.get_node_ip_by_host_name('node-3.domain.local') == ''
+    assert fuel_nodes.requests == 3
+
+
+def test_lookup_uses_inventory_on_hit(env, fuel_nodes):
+    assert env.get_node_ip_by_host_name('node-1.domain.local') == '10.20.0.3'
+    assert env.find_node_by_ip('10.20.0.3').data['name'] == 'node-1'
+    assert fuel_nodes.requests == 1
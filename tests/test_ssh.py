@@ -0,0 +1,298 @@
+import hashlib
+import io
+import os
+import subprocess
+import tarfile
+
+import pytest
+
+from mos_tests.environment import ssh
+from mos_tests.environment.ssh import CommandResult
+from mos_tests.environment.ssh import SSHClient
+
+
+class FakeFile(object):
+    """sftp file stub over local file, which may break after some bytes"""
+
+    def __init__(self, sftp, path, mode):
+        self.sftp = sftp
+        self.file = open(path, mode)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *err):
+        self.file.close()
+
+    def set_pipelined(self, pipelined):
+        pass
+
+    def seek(self, offset):
+        self.file.seek(offset)
+
+    def write(self, data):
+        self.sftp.check_broken(len(data))
+        self.file.write(data)
+
+    def readv(self, chunks):
+        self.sftp.readv_calls.append(list(chunks))
+        for offset, size in chunks:
+            self.sftp.check_broken(size)
+            self.file.seek(offset)
+            yield self.file.read(size)
+
+
+class FakeSFTP(object):
+    """sftp client stub, which works with local files
+
+    :param break_after: count of bytes transferred before connection break
+    """
+
+    def __init__(self, break_after=None):
+        self.break_after = break_after
+        self.transferred = 0
+        self.readv_calls = []
+        self.opened = []
+
+    def check_broken(self, size):
+        self.transferred += size
+        if self.break_after is not None and \
+                self.transferred > self.break_after:
+            self.break_after = None
+            raise EOFError('connection lost')
+
+    def open(self, path, mode='r'):
+        self.opened.append((path, mode))
+        return FakeFile(self, path, mode)
+
+    def stat(self, path):
+        return os.stat(path)
+
+    def lstat(self, path):
+        return os.lstat(path)
+
+    def close(self):
+        pass
+
+
+class FakeChannel(object):
+    """Exec channel stub, which extracts received tar stream locally"""
+
+    def __init__(self, client):
+        self.client = client
+        self.stream = io.BytesIO()
+        self.stream.flush = lambda: None
+
+    def exec_command(self, command):
+        self.client.commands.append(command)
+        self.target = command.split(' -C ')[-1]
+
+    def makefile(self, mode):
+        return self.stream
+
+    def shutdown_write(self):
+        pass
+
+    def recv_exit_status(self):
+        self.stream.seek(0)
+        with tarfile.open(fileobj=self.stream, mode='r|*') as tar:
+            tar.extractall(self.target)
+        return 0
+
+    def makefile_stderr(self, mode):
+        return io.BytesIO()
+
+    def close(self):
+        pass
+
+
+class FakeClient(SSHClient):
+
+    def __init__(self, sftp):
+        super(FakeClient, self).__init__('10.0.0.1')
+        self.fake_sftp = sftp
+        self._sftp_client = sftp
+        self.commands = []
+        self.reconnects = 0
+
+    def _open_transfer_sftp(self):
+        return self.fake_sftp
+
+    def reconnect(self):
+        self.reconnects += 1
+
+    def get_transport(self):
+        return self
+
+    def open_session(self, timeout=None):
+        return FakeChannel(self)
+
+    @property
+    def _ssh(self):
+        return self
+
+    @_ssh.setter
+    def _ssh(self, value):
+        pass
+
+    def clear(self):
+        pass
+
+    def execute(self, command, verbose=True):
+        proc = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        stdout, stderr = proc.communicate()
+        return CommandResult({'stdout': stdout.splitlines(True),
+                              'stderr': stderr.splitlines(True),
+                              'exit_code': proc.returncode})
+
+
+@pytest.yield_fixture
+def transfers():
+    stats = []
+    ssh.transfer_hooks.append(stats.append)
+    yield stats
+    ssh.transfer_hooks.remove(stats.append)
+
+
+def make_file(path, size):
+    with open(path, 'wb') as f:
+        f.write(os.urandom(size))
+    return path
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_upload_resume(tmpdir, transfers):
+    source = make_file(str(tmpdir.join('source')), 1000)
+    target = str(tmpdir.join('target'))
+    client = FakeClient(FakeSFTP(break_after=600))
+    client.sftp_request_size = 100
+
+    client.upload(source, target)
+
+    assert read(target) == read(source)
+    assert client.reconnects == 1
+    # resumed from remote file size, not from start
+    assert client.fake_sftp.opened[-1] == (target, 'r+b')
+    assert client.fake_sftp.transferred < 2 * 1000
+    assert [x.size for x in transfers] == [1000]
+
+
+def test_upload_not_resumed_before_target_opened(tmpdir):
+    source = make_file(str(tmpdir.join('source')), 1000)
+    target = make_file(str(tmpdir.join('target')), 2000)
+    sftp = FakeSFTP()
+    client = FakeClient(sftp)
+    opened = []
+
+    def open_transfer_sftp():
+        if not opened:
+            opened.append(True)
+            raise EOFError('connection lost')
+        return sftp
+
+    client._open_transfer_sftp = open_transfer_sftp
+
+    client.upload(source, target)
+
+    assert read(target) == read(source)
+    assert sftp.opened == [(target, 'wb')]
+
+
+@pytest.mark.parametrize('streams', [1, 4])
+def test_download(tmpdir, transfers, streams):
+    source = make_file(str(tmpdir.join('source')), 10000)
+    target = str(tmpdir.join('target'))
+    client = FakeClient(FakeSFTP())
+    client.sftp_request_size = 100
+    client.sftp_pipeline_depth = 8
+
+    assert client.download(source, target, streams=streams)
+
+    assert read(target) == read(source)
+    # parts are removed
+    assert sorted(os.listdir(str(tmpdir))) == ['source', 'target']
+    readv_calls = client.fake_sftp.readv_calls
+    assert all(len(x) <= 8 for x in readv_calls)
+    assert sum(size for call in readv_calls for _, size in call) == 10000
+    assert [x.size for x in transfers] == [10000]
+
+
+def test_download_resume(tmpdir):
+    source = make_file(str(tmpdir.join('source')), 10000)
+    target = str(tmpdir.join('target'))
+    client = FakeClient(FakeSFTP(break_after=3000))
+    client.sftp_request_size = 100
+
+    assert client.download(source, target, streams=4)
+
+    assert read(target) == read(source)
+    assert client.reconnects == 1
+    # already downloaded parts of segments are not requested again
+    assert client.fake_sftp.transferred < 10000 + 3000 + 100 * 4
+
+
+def test_download_missing(tmpdir):
+    client = FakeClient(FakeSFTP())
+    target = str(tmpdir.join('target'))
+    assert not client.download(str(tmpdir.join('missing')), target)
+
+
+def make_tree(root):
+    os.makedirs(os.path.join(root, 'sub', 'empty'))
+    make_file(os.path.join(root, 'a.txt'), 100)
+    make_file(os.path.join(root, 'sub', 'b.txt'), 200)
+    return root
+
+
+def tree_checksums(root):
+    checksums = {}
+    for rootdir, _, files in os.walk(root):
+        for name in files:
+            path = os.path.join(rootdir, name)
+            checksums[os.path.relpath(path, root)] = hashlib.md5(
+                read(path)).hexdigest()
+    return checksums
+
+
+@pytest.mark.parametrize('compression', [None, 'gz', 'bz2'])
+def test_upload_tar(tmpdir, compression):
+    source = make_tree(str(tmpdir.join('source')))
+    target = str(tmpdir.join('target'))
+    client = FakeClient(FakeSFTP())
+
+    client.upload(source, target, compression=compression)
+
+    assert tree_checksums(target) == tree_checksums(source)
+    assert os.path.isdir(os.path.join(target, 'sub', 'empty'))
+    assert '--no-same-owner' in client.commands[-1]
+
+
+def test_upload_tar_unsupported_compression(tmpdir):
+    source = make_tree(str(tmpdir.join('source')))
+    client = FakeClient(FakeSFTP())
+    with pytest.raises(ValueError):
+        client.upload(source, str(tmpdir.join('target')), compression='xz')
+
+
+def test_upload_tar_skip_unchanged(tmpdir):
+    source = make_tree(str(tmpdir.join('source', 'data')))
+    # directory is uploaded into existing target directory
+    target_dir = str(tmpdir.mkdir('target'))
+    target = os.path.join(target_dir, 'data')
+    client = FakeClient(FakeSFTP())
+    client.upload(source, target_dir)
+    del client.commands[:]
+
+    client.upload(source, target_dir, skip_unchanged=True)
+    assert client.commands == []
+
+    make_file(os.path.join(source, 'sub', 'b.txt'), 300)
+    os.remove(os.path.join(target, 'a.txt'))
+    client.upload(source, target_dir, skip_unchanged=True)
+    assert len(client.commands) == 1
+    assert tree_checksums(target) == tree_checksums(source)